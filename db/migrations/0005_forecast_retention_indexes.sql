@@ -0,0 +1,2 @@
+CREATE INDEX "idx_consumption_forecast_site_generated" ON "consumption_forecasts" USING btree ("site_id","generated_at");--> statement-breakpoint
+CREATE INDEX "idx_forecast_site_generated" ON "weather_forecasts" USING btree ("site_id","generated_at");
\ No newline at end of file
@@ -0,0 +1,4 @@
+-- measurements is the largest table: on an existing database build this index
+-- out of band with CREATE INDEX CONCURRENTLY before running db:migrate (see
+-- "Large-table indexes" in db/README.md); IF NOT EXISTS then makes this a no-op.
+CREATE INDEX IF NOT EXISTS "idx_measurements_meter_time" ON "measurements" USING btree ("entity_id","timestamp") INCLUDE ("value") WHERE "measurements"."entity_type" = 'meter';
@@ -11,7 +11,7 @@ import {
   index,
   uniqueIndex,
 } from "drizzle-orm/pg-core";
-import { relations } from "drizzle-orm";
+import { relations, sql } from "drizzle-orm";
 
 // ===============================
 // 1. ENUMS & FOUNDATIONAL TYPES
@@ -169,6 +169,11 @@ export const measurements = pgTable(
     ),
     timestampIdx: index("idx_measurements_timestamp").on(table.timestamp),
     metricIdx: index("idx_measurements_metric").on(table.metric),
+    // Serves the ML service's per-meter time-range fetch. The migration also
+    // adds INCLUDE (value) so that fetch can be an index-only scan.
+    meterTimeIdx: index("idx_measurements_meter_time")
+      .on(table.entityId, table.timestamp)
+      .where(sql`${table.entityType} = 'meter'`),
   })
 );
 
@@ -340,6 +345,8 @@ export const consumptionForecasts = pgTable(
   (table) => ({
     siteTimeIdx: index("idx_consumption_forecast_site_time").on(table.siteId, table.forecastTimestamp),
     generatedIdx: index("idx_consumption_forecast_generated").on(table.generatedAt),
+    // Retention deletes filter by site and generated_at
+    siteGeneratedIdx: index("idx_consumption_forecast_site_generated").on(table.siteId, table.generatedAt),
     horizonIdx: index("idx_consumption_forecast_horizon").on(table.forecastHorizonHours),
     timestampIdx: index("idx_consumption_forecast_timestamp").on(table.forecastTimestamp),
   })
@@ -385,6 +392,8 @@ export const weatherForecasts = pgTable(
   (table) => ({
     siteTimeIdx: index("idx_forecast_site_time").on(table.siteId, table.forecastTimestamp),
     generatedIdx: index("idx_forecast_generated").on(table.generatedAt),
+    // Retention deletes filter by site and generated_at
+    siteGeneratedIdx: index("idx_forecast_site_generated").on(table.siteId, table.generatedAt),
     horizonIdx: index("idx_forecast_horizon").on(table.forecastHorizonHours),
   })
 );
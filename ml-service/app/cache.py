@@ -0,0 +1,153 @@
+"""
+In-process caches shared by the database helpers and routers
+
+Entries live in process memory only - each worker keeps its own copy.
+"""
+
+import functools
+import hashlib
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import orjson
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire `ttl` seconds after they are set"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value, or default if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store a value, evicting the least recently used entry when full"""
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an entry and return its value"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[1] if entry else default
+
+    def items(self) -> List[tuple]:
+        """Snapshot of the unexpired (key, value) pairs, least recently used first"""
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value) for key, (expires_at, value) in self._data.items() if expires_at > now]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def ttl_cached(ttl: float, maxsize: int = 128, cache_if: Optional[Callable[[Any], bool]] = None):
+    """
+    Memoize a function's result for `ttl` seconds, keyed on its arguments.
+
+    Works on plain and async functions (the awaited result is cached).
+    Cached values are shared between callers and must be treated as read-only.
+    Results for which cache_if(result) is false are returned but not stored.
+    """
+    def decorator(fn):
+        cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                key = (args, tuple(sorted(kwargs.items())))
+                value = cache.get(key)
+                if value is None:
+                    value = await fn(*args, **kwargs)
+                    if cache_if is None or cache_if(value):
+                        cache.set(key, value)
+                return value
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                key = (args, tuple(sorted(kwargs.items())))
+                value = cache.get(key)
+                if value is None:
+                    value = fn(*args, **kwargs)
+                    if cache_if is None or cache_if(value):
+                        cache.set(key, value)
+                return value
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+def _update_with_weather(digest: Any, weather: Optional[List[Dict]]) -> None:
+    """Feed every weather reading (all fields, in order) into digest"""
+    # default=str covers values orjson has no native encoding for (e.g. Decimal)
+    payload = orjson.dumps(weather or [], default=str)
+    digest.update(len(payload).to_bytes(8, 'little'))
+    digest.update(payload)
+
+
+# Recent consumption forecasts, shared by /api/forecast/consumption and
+# /api/recommend/generate so a repeat request within the TTL skips the Prophet fit
+FORECAST_CACHE_TTL_SECONDS = int(os.getenv("FORECAST_CACHE_TTL_SECONDS", "300"))
+FORECAST_CACHE = TTLCache(maxsize=256, ttl=FORECAST_CACHE_TTL_SECONDS)
+
+
+def forecast_cache_key(model_key: str, hours_ahead: int,
+                       future_weather: Optional[List[Dict]] = None) -> tuple:
+    """
+    Key a forecast by the model_cache_key of its training inputs, the horizon
+    and a digest of every future weather reading, so new measurements or a
+    refreshed weather forecast (even for the same hours) invalidate the entry.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    _update_with_weather(digest, future_weather)
+    return (model_key, hours_ahead, digest.hexdigest())
+
+
+# Fitted Prophet models (serialized with prophet.serialize.model_to_json), keyed
+# on the training data, so a new horizon or new future weather re-uses the fit
+MODEL_CACHE_TTL_SECONDS = int(os.getenv("MODEL_CACHE_TTL_SECONDS", "3600"))
+MODEL_CACHE = TTLCache(maxsize=64, ttl=MODEL_CACHE_TTL_SECONDS)
+
+
+def model_cache_key(site_id: str, training_days: int, measurements: Dict,
+                    weather_data: Optional[List[Dict]] = None) -> str:
+    """
+    Hash of everything a fit depends on: the site, window, every measurement
+    (timestamp and value buffers) and every historical weather reading, so a
+    corrected or backfilled reading gets a new key even if the row count and
+    newest timestamp stay the same.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{site_id}|{training_days}|".encode())
+    for column in ('timestamp', 'value'):
+        data = measurements[column].tobytes()
+        digest.update(len(data).to_bytes(8, 'little'))
+        digest.update(data)
+    _update_with_weather(digest, weather_data)
+    return digest.hexdigest()
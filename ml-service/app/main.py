@@ -1,18 +1,62 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from contextlib import asynccontextmanager
+import logging
+import logging.handlers
+import queue
 import uvicorn
 import os
 from dotenv import load_dotenv
 
+from app.database import init_pool, close_pool
+from app.workers import start_workers, shutdown_process_pool
+from app.services.clients import init_clients, close_clients
 from app.routers import forecasting, recommendations
 
 # Load environment variables
 load_dotenv()
 
+# Application logs go through a queue; a background listener thread does the
+# actual stream I/O so request handlers never block on stdout. The queue
+# handler is only installed in lifespan: spawned pool workers re-import this
+# module (as __mp_main__ under `python -m app.main`) but never run lifespan,
+# so they would fill a queue nothing drains. They log directly instead (see
+# app.workers._init_worker).
+_log_queue = queue.SimpleQueue()
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream_handler)
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "info").upper(),
+        handlers=[logging.handlers.QueueHandler(_log_queue)],
+        force=True
+    )
+    _log_listener.start()
+    # Open the database pool up front so the first request doesn't pay for it
+    try:
+        init_pool()
+    except Exception as e:
+        logger.warning("Could not initialize database pool at startup: %s", e)
+    start_workers()
+    init_clients()
+    yield
+    await close_clients()
+    shutdown_process_pool()
+    close_pool()
+    _log_listener.stop()
+
 app = FastAPI(
     title="Enalysis ML Service",
     description="Machine Learning service for energy management recommendations",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    # Serialize responses with orjson (C, native datetime/numpy support)
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
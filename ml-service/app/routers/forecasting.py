@@ -2,9 +2,12 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from datetime import datetime, timedelta
 from typing import List, Dict
+import asyncio
 
+from app.cache import FORECAST_CACHE, MODEL_CACHE, forecast_cache_key, model_cache_key
 from app.database import fetch_measurements
-from app.services.consumption_forecaster import ConsumptionForecaster
+from app.services.consumption_forecaster import train_and_forecast
+from app.workers import run_in_process
 
 router = APIRouter()
 
@@ -16,7 +19,7 @@ class ForecastRequest(BaseModel):
 class ForecastResponse(BaseModel):
     site_id: str
     forecast_horizon_hours: int
-    generated_at: str
+    generated_at: datetime
     predictions: List[Dict]
 
 @router.post("/consumption", response_model=ForecastResponse)
@@ -27,28 +30,37 @@ async def forecast_consumption(request: ForecastRequest):
         end_date = datetime.now()
         start_date = end_date - timedelta(days=request.training_days)
 
-        measurements = fetch_measurements(
+        measurements = await asyncio.to_thread(
+            fetch_measurements,
             site_id=request.site_id,
             start_date=start_date.isoformat(),
             end_date=end_date.isoformat(),
             meter_category="CONS"
         )
 
-        if len(measurements) < 48:
+        if len(measurements['value']) < 48:
             raise HTTPException(
                 status_code=400,
-                detail=f"Insufficient historical data. Found {len(measurements)} measurements, need at least 48."
+                detail=f"Insufficient historical data. Found {len(measurements['value'])} measurements, need at least 48."
             )
 
-        # Train and forecast
-        forecaster = ConsumptionForecaster()
-        forecaster.train(measurements)
-        predictions = forecaster.get_forecast_dict(hours_ahead=request.hours_ahead)
+        # Reuse a recent forecast on the same data; otherwise forecast in the
+        # process pool (so the event loop stays free), refitting only when no
+        # model for this training data is cached
+        model_key = model_cache_key(request.site_id, request.training_days, measurements)
+        cache_key = forecast_cache_key(model_key, request.hours_ahead)
+        predictions = FORECAST_CACHE.get(cache_key)
+        if predictions is None:
+            predictions, model_json = await run_in_process(
+                train_and_forecast, measurements, request.hours_ahead, None, None, MODEL_CACHE.get(model_key)
+            )
+            MODEL_CACHE.set(model_key, model_json)
+            FORECAST_CACHE.set(cache_key, predictions)
 
         return ForecastResponse(
             site_id=request.site_id,
             forecast_horizon_hours=request.hours_ahead,
-            generated_at=datetime.now().isoformat(),
+            generated_at=datetime.now(),
             predictions=predictions
         )
 
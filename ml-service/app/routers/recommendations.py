@@ -1,26 +1,163 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from datetime import datetime, timedelta
-from typing import List, Dict
-import numpy as np
+from typing import List, Dict, Optional, Tuple
+import asyncio
+import functools
+import logging
+import re
 
+from app.cache import FORECAST_CACHE, MODEL_CACHE, forecast_cache_key, model_cache_key
 from app.database import (
-    fetch_measurements,
+    get_db_connection,
+    fetch_request_context,
     fetch_carbon_intensity,
-    fetch_electricity_pricing,
-    save_recommendation,
-    save_consumption_forecast,
-    delete_old_forecasts,
-    save_weather_forecast,
-    delete_old_weather_forecasts,
-    get_site_coordinates
+    save_recommendations,
+    replace_consumption_forecasts,
+    replace_weather_forecasts
 )
-from app.services.consumption_forecaster import ConsumptionForecaster
-from app.services.recommendation_engine import RecommendationEngine
-from app.services.weather_service import WeatherService
+from app.services.consumption_forecaster import train_and_forecast
+from app.services.clients import (
+    get_caiso_client,
+    get_carbon_client,
+    get_recommendation_engine,
+    get_weather_service
+)
+from app.workers import run_in_process
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Location keywords -> Electricity Maps zone code. Matched on word boundaries so
+# e.g. "Canada" doesn't count as the "CA" state abbreviation.
+CAISO_ZONE = "US-CAL-CISO"
+LOCATION_ZONES = {
+    'california': CAISO_ZONE,
+    'ca': CAISO_ZONE,
+    'san francisco': CAISO_ZONE,
+    'los angeles': CAISO_ZONE,
+    'san diego': CAISO_ZONE,
+    'sacramento': CAISO_ZONE,
+    'ontario': "CA-ON",
+    'toronto': "CA-ON",
+    'ottawa': "CA-ON",
+}
+_LOCATION_PATTERN = re.compile(
+    r"\b(" + "|".join(
+        re.escape(k).replace(r"\ ", r"\s+") for k in sorted(LOCATION_ZONES, key=len, reverse=True)
+    ) + r")\b"
+)
+
+# A site's location text rarely changes, so classifications are memoized
+@functools.lru_cache(maxsize=1024)
+def classify_location(location: Optional[str]) -> Tuple[Optional[str], bool]:
+    """Map a free-text site location to (grid_zone, is_caiso) in a single scan"""
+    if not location:
+        return None, False
+    zones = {
+        LOCATION_ZONES[" ".join(m.group(1).split())]
+        for m in _LOCATION_PATTERN.finditer(location.lower())
+    }
+    if CAISO_ZONE in zones:
+        return CAISO_ZONE, True
+    if zones:
+        return zones.pop(), False
+    return None, False
+
+async def _resolved(value):
+    """Awaitable placeholder for a fetch that doesn't apply to this site"""
+    return value
+
+async def _fetch_carbon_forecast(grid_zone: str, hours: int, start_date: datetime, end_date: datetime) -> List[Dict]:
+    """Fetch carbon intensity forecast - real-time API first, database as fallback"""
+    try:
+        carbon_client = get_carbon_client()
+
+        # Fetch real-time carbon intensity using grid zone
+        carbon_forecast_api = await carbon_client.get_carbon_intensity(zone=grid_zone, hours_forecast=hours)
+
+        # Convert to format expected by recommendation engine
+        carbon_forecast_data = [
+            {
+                'timestamp': cf['timestamp'],
+                'carbon_intensity': cf['carbon_intensity']
+            }
+            for cf in carbon_forecast_api
+        ]
+
+        logger.info("Fetched %d carbon intensity records from Electricity Maps for %s", len(carbon_forecast_data), grid_zone)
+        return carbon_forecast_data
+    except Exception as e:
+        logger.warning("Could not fetch real-time carbon intensity: %s - falling back to database for %s", e, grid_zone)
+
+        # Fall back to database using grid zone
+        carbon_forecast_db = await asyncio.to_thread(
+            fetch_carbon_intensity,
+            start_date=start_date.isoformat(),
+            end_date=end_date.isoformat(),
+            grid_zone=grid_zone
+        )
+        return carbon_forecast_db if carbon_forecast_db else []
+
+async def _fetch_caiso_pricing() -> List[Dict]:
+    """Fetch hourly-averaged CAISO real-time pricing"""
+    try:
+        caiso_client = get_caiso_client()
+        # Get hourly average real-time pricing for next 24 hours
+        caiso_pricing = await caiso_client.get_hourly_average(hours=48)
+        logger.info("Fetched %d CAISO real-time pricing records", len(caiso_pricing))
+        return caiso_pricing
+    except Exception as e:
+        logger.warning("Could not fetch CAISO pricing: %s", e)
+        return []
+
+def _save_results(site_id: str, consumption_forecast: List[Dict], training_data_points: int,
+                  training_days: int, weather_forecasts: Optional[List[Dict]], site_info: Optional[Dict],
+                  weather_source: str, recommendations: List[Dict]) -> Tuple[int, int, int]:
+    """
+    Save the consumption forecast, weather forecast and recommendations in one
+    transaction on one connection (old forecasts are dropped in the same
+    statements: 30-day retention for consumption, 7-day for weather).
+
+    Returns (forecasts_saved, weather_forecasts_saved, recommendations_saved);
+    all zero if the transaction fails.
+    """
+    try:
+        with get_db_connection() as conn:
+            forecasts_saved = replace_consumption_forecasts(
+                site_id=site_id,
+                forecasts=consumption_forecast,
+                model_type='prophet',
+                confidence=0.8,  # 80% confidence interval
+                training_data_points=training_data_points,
+                retention_days=30,
+                metadata={'training_days': training_days},
+                conn=conn
+            )
+
+            weather_forecasts_saved = 0
+            if weather_forecasts:
+                weather_forecasts_saved = replace_weather_forecasts(
+                    site_id=site_id,
+                    forecasts=weather_forecasts,
+                    data_source=weather_source,
+                    retention_days=7,
+                    metadata={
+                        'latitude': float(site_info['latitude']),
+                        'longitude': float(site_info['longitude']),
+                        'location': site_info.get('location', '')
+                    },
+                    conn=conn
+                )
+
+            saved_count = save_recommendations(site_id=site_id, recommendations=recommendations, conn=conn)
+            conn.commit()
+            return forecasts_saved, weather_forecasts_saved, saved_count
+    except Exception as e:
+        logger.error("Error saving forecasts and recommendations: %s", e)
+        return 0, 0, 0
+
 class RecommendationRequest(BaseModel):
     site_id: str
     forecast_hours: int = 24
@@ -28,7 +165,7 @@ class RecommendationRequest(BaseModel):
 
 class RecommendationResponse(BaseModel):
     site_id: str
-    generated_at: str
+    generated_at: datetime
     recommendations: List[Dict]
     saved_count: int
     forecasts_saved: int = 0
@@ -42,222 +179,113 @@ async def generate_recommendations(request: RecommendationRequest):
         start_date = end_date - timedelta(days=request.training_days)
         forecast_end = end_date + timedelta(hours=request.forecast_hours)
 
-        # Fetch historical consumption data
-        measurements = fetch_measurements(
+        # Fetch historical consumption data, site info, pricing and historical
+        # weather (for better forecast accuracy) in one checkout
+        context = await asyncio.to_thread(
+            fetch_request_context,
             site_id=request.site_id,
-            start_date=start_date.isoformat(),
-            end_date=end_date.isoformat(),
-            meter_category="CONS"
+            start_date=start_date,
+            end_date=end_date,
+            meter_category="CONS",
+            include_weather_history=True
         )
+        measurements = context['measurements']
+        site_info = context['site']
+        pricing_data = context['pricing']
+        historical_weather = context['weather_history']
 
-        if len(measurements) < 48:
+        if len(measurements['value']) < 48:
             raise HTTPException(
                 status_code=400,
                 detail=f"Insufficient historical data for site {request.site_id}"
             )
 
-        # Fetch historical weather data for better forecast accuracy
-        historical_weather = None
-        future_weather_data = None
-
-        # Get site coordinates
-        site_info = get_site_coordinates(site_id=request.site_id)
-
-        if site_info and site_info['latitude'] and site_info['longitude']:
-            lat, lon = float(site_info['latitude']), float(site_info['longitude'])
-            solar_capacity = float(site_info.get('solar_capacity_kw', 100.0))
-
-            weather_service = WeatherService()
+        # Classify the free-text location once; used for the grid zone fallback
+        # and to decide whether CAISO real-time pricing applies
+        location_zone, is_caiso = classify_location(site_info.get('location') if site_info else None)
 
-            # Fetch future weather forecast (for prediction period)
-            future_weather_data = weather_service.get_weather_forecast(lat, lon, solar_capacity)
+        # Get grid zone from site info - this is now the source of truth
+        grid_zone = site_info.get('grid_zone') if site_info else None
 
-            # Fetch historical weather from database (weather_forecasts table)
-            try:
-                from app.database import fetch_weather_forecasts
-                historical_weather = fetch_weather_forecasts(
-                    site_id=request.site_id,
-                    start_date=start_date.isoformat(),
-                    end_date=end_date.isoformat()
-                )
-                if historical_weather and len(historical_weather) > 0:
-                    print(f"✓ Using {len(historical_weather)} historical weather records for ML training")
-                else:
-                    print(f"Note: No historical weather data available for training")
-            except Exception as e:
-                print(f"Note: Could not fetch historical weather: {e}")
-                historical_weather = None
-
-        # Generate consumption forecast with weather-enhanced Prophet model
-        forecaster = ConsumptionForecaster()
-        forecaster.train(measurements, weather_data=historical_weather)
-        consumption_forecast = forecaster.get_forecast_dict(
-            hours_ahead=request.forecast_hours,
-            future_weather=future_weather_data
-        )
+        if not grid_zone:
+            # Fallback: determine grid zone from location text if not set
+            grid_zone = location_zone or "CA-ON"  # Default to Ontario
 
-        # Delete old forecasts (retention policy: 30 days)
-        delete_old_forecasts(site_id=request.site_id, retention_days=30)
-
-        # Save consumption forecasts to database
-        forecasts_saved = 0
-        for i, fc in enumerate(consumption_forecast):
-            try:
-                forecast_id = save_consumption_forecast(
-                    site_id=request.site_id,
-                    forecast_timestamp=fc['timestamp'],
-                    predicted_value=float(fc['predicted_value']),
-                    lower_bound=float(fc['lower_bound']),
-                    upper_bound=float(fc['upper_bound']),
-                    forecast_horizon_hours=i + 1,  # Hours ahead
-                    model_type='prophet',
-                    confidence=0.8,  # 80% confidence interval
-                    training_data_points=len(measurements),
-                    metadata={'training_days': request.training_days}
-                )
-                if forecast_id:
-                    forecasts_saved += 1
-            except Exception as e:
-                print(f"Error saving forecast: {e}")
+        logger.info("Using grid zone: %s", grid_zone)
+        logger.debug("Pricing data fetched: %s", pricing_data)
+        if historical_weather:
+            logger.info("Using %d historical weather records for ML training", len(historical_weather))
+        else:
+            logger.info("No historical weather data available for training")
 
-        # Save weather forecasts (already fetched above for ML training)
-        weather_forecasts_saved = 0
-        if future_weather_data:
-            weather_forecasts = future_weather_data
+        # Weather forecast, carbon intensity and CAISO pricing are independent
+        # of each other - fetch them concurrently
+        weather_service = get_weather_service()
+        if site_info and site_info['latitude'] and site_info['longitude']:
             lat, lon = float(site_info['latitude']), float(site_info['longitude'])
-            print(f"Using coordinates for {site_info['name']}: {lat}, {lon}")
-
-            # Delete old weather forecasts (7-day retention)
-            delete_old_weather_forecasts(site_id=request.site_id, retention_days=7)
-
-            if weather_forecasts:
-                for i, wf in enumerate(weather_forecasts):
-                    try:
-                        wf_id = save_weather_forecast(
-                            site_id=request.site_id,
-                            forecast_timestamp=wf['timestamp'],
-                            forecast_horizon_hours=i + 1,
-                            temperature=wf.get('temperature'),
-                            cloud_cover=wf.get('cloud_cover'),
-                            wind_speed=wf.get('wind_speed'),
-                            precipitation=wf.get('precipitation'),
-                            precipitation_probability=wf.get('precipitation_probability'),
-                            solar_irradiance=wf.get('solar_irradiance'),
-                            solar_generation=wf.get('solar_generation'),
-                            confidence=wf.get('confidence'),
-                            data_source='openweathermap' if weather_service.api_key and weather_service.api_key != 'your_api_key_here' else 'mock',
-                            metadata={
-                                'description': wf.get('description', ''),
-                                'latitude': lat,
-                                'longitude': lon,
-                                'location': site_info.get('location', '')
-                            }
-                        )
-                        if wf_id:
-                            weather_forecasts_saved += 1
-                    except Exception as e:
-                        print(f"Error saving weather forecast: {e}")
+            solar_capacity = float(site_info.get('solar_capacity_kw', 100.0))
+            # Future weather forecast (for prediction period)
+            weather_fetch = asyncio.to_thread(weather_service.get_weather_forecast, lat, lon, solar_capacity)
         else:
-            print(f"[WARNING] Site {request.site_id} has no coordinates - skipping weather forecast")
+            weather_fetch = _resolved(None)
 
-        # Fetch carbon intensity forecast
-        # Try to use real-time API first, fall back to database
-        carbon_forecast_data = []
+        # Real-time CAISO pricing only applies to sites in California
+        caiso_fetch = _fetch_caiso_pricing() if is_caiso else _resolved([])
 
-        # Get grid zone from site info - this is now the source of truth
-        grid_zone = site_info.get('grid_zone', 'CA-ON') if site_info else 'CA-ON'
+        future_weather_data, carbon_forecast, caiso_pricing = await asyncio.gather(
+            weather_fetch,
+            _fetch_carbon_forecast(grid_zone, request.forecast_hours, end_date, forecast_end),
+            caiso_fetch
+        )
 
-        if not grid_zone:
-            # Fallback: determine grid zone from location text if not set
-            grid_zone = "CA-ON"  # Default to Ontario
-            if site_info and site_info.get('location'):
-                location = site_info.get('location', '').lower()
-                # Map locations to Electricity Maps zone codes
-                if any(indicator in location for indicator in ['california', 'ca', 'san francisco', 'los angeles']):
-                    grid_zone = "US-CAL-CISO"
-                elif 'ontario' in location or 'toronto' in location or 'ottawa' in location:
-                    grid_zone = "CA-ON"
-
-        print(f"[INFO] Using grid zone: {grid_zone}")
-
-        try:
-            from app.services.carbon_intensity_client import CarbonIntensityClient
-            carbon_client = CarbonIntensityClient()
-
-            # Fetch real-time carbon intensity using grid zone
-            carbon_forecast_api = carbon_client.get_carbon_intensity(zone=grid_zone, hours_forecast=request.forecast_hours)
-
-            # Convert to format expected by recommendation engine
-            carbon_forecast_data = [
-                {
-                    'timestamp': cf['timestamp'],
-                    'carbon_intensity': cf['carbon_intensity']
-                }
-                for cf in carbon_forecast_api
-            ]
-
-            print(f"[OK] Fetched {len(carbon_forecast_data)} carbon intensity records from Electricity Maps for {grid_zone}")
-        except Exception as e:
-            print(f"[WARNING] Could not fetch real-time carbon intensity: {e}")
-            print(f"Falling back to database carbon intensity for {grid_zone}")
-
-            # Fall back to database using grid zone
-            carbon_forecast_db = fetch_carbon_intensity(
-                start_date=end_date.isoformat(),
-                end_date=forecast_end.isoformat(),
-                grid_zone=grid_zone
+        # Generate consumption forecast with weather-enhanced Prophet model, reusing
+        # a recent forecast on the same data, or at least the fitted model
+        # (forecasting runs in the process pool on a miss)
+        model_key = model_cache_key(request.site_id, request.training_days, measurements, historical_weather)
+        cache_key = forecast_cache_key(model_key, request.forecast_hours, future_weather_data)
+        consumption_forecast = FORECAST_CACHE.get(cache_key)
+        if consumption_forecast is None:
+            consumption_forecast, model_json = await run_in_process(
+                train_and_forecast,
+                measurements,
+                request.forecast_hours,
+                historical_weather,
+                future_weather_data,
+                MODEL_CACHE.get(model_key)
             )
-            carbon_forecast_data = carbon_forecast_db if carbon_forecast_db else []
-
-        carbon_forecast = carbon_forecast_data
+            MODEL_CACHE.set(model_key, model_json)
+            FORECAST_CACHE.set(cache_key, consumption_forecast)
 
-        # Fetch pricing data
-        print(f"[INFO] Fetching pricing data for site {request.site_id}")
-        try:
-            pricing_data = fetch_electricity_pricing(
-                site_id=request.site_id,
-                start_date=start_date.date().isoformat(),
-                end_date=end_date.date().isoformat()
+        if future_weather_data:
+            logger.debug(
+                "Using coordinates for %s: %s, %s",
+                site_info['name'], site_info['latitude'], site_info['longitude']
             )
-            print(f"[OK] Pricing data fetched: {pricing_data}")
-        except Exception as e:
-            print(f"[ERROR] Error fetching pricing: {e}")
-            import traceback
-            traceback.print_exc()
-            pricing_data = None
-
-        # Fetch real-time CAISO pricing if site is in California
-        caiso_pricing = []
-        if site_info and site_info.get('location'):
-            location = site_info.get('location', '').lower()
-            # Check if site is in CAISO territory (California)
-            if any(indicator in location for indicator in ['california', 'ca', 'san francisco', 'los angeles', 'san diego', 'sacramento']):
-                try:
-                    from app.services.caiso_client import CAISOClient
-                    caiso_client = CAISOClient()
-                    # Get hourly average real-time pricing for next 24 hours
-                    caiso_pricing = caiso_client.get_hourly_average(hours=48)
-                    print(f"[OK] Fetched {len(caiso_pricing)} CAISO real-time pricing records")
-                except Exception as e:
-                    print(f"[WARNING] Could not fetch CAISO pricing: {e}")
+        else:
+            logger.warning("Site %s has no coordinates - skipping weather forecast", request.site_id)
 
         # Calculate historical baseline for efficiency detection
         historical_baseline = None
-        if len(measurements) >= 48:
+        if len(measurements['value']) >= 48:
             # Use the average of historical measurements as baseline
-            historical_baseline = np.mean([m['value'] for m in measurements])
+            historical_baseline = float(measurements['value'].mean())
 
         # Generate recommendations
-        engine = RecommendationEngine()
-        print(f"[INFO] Generating recommendations with:")
-        print(f"   Consumption forecast: {len(consumption_forecast)} records")
-        print(f"   Carbon forecast: {len(carbon_forecast)} records")
-        print(f"   Pricing data: {pricing_data}")
-        print(f"   CAISO pricing: {len(caiso_pricing) if caiso_pricing else 0} records")
-        print(f"   Weather forecast: {len(future_weather_data) if future_weather_data else 0} records")
-        print(f"   Historical baseline: {historical_baseline:.2f} kWh" if historical_baseline else "   Historical baseline: None")
-
-        recommendations = engine.generate_recommendations(
+        engine = get_recommendation_engine()
+        logger.info(
+            "Generating recommendations with: consumption forecast=%d, carbon forecast=%d, "
+            "CAISO pricing=%d, weather forecast=%d records, historical baseline=%s kWh",
+            len(consumption_forecast),
+            len(carbon_forecast),
+            len(caiso_pricing) if caiso_pricing else 0,
+            len(future_weather_data) if future_weather_data else 0,
+            historical_baseline
+        )
+        logger.debug("Pricing data: %s", pricing_data)
+
+        # Pure CPU work, but kept off the event loop like the DB calls
+        recommendations = await asyncio.to_thread(
+            engine.generate_recommendations,
             consumption_forecast=consumption_forecast,
             carbon_forecast=carbon_forecast,
             pricing_data=pricing_data or {},
@@ -266,33 +294,24 @@ async def generate_recommendations(request: RecommendationRequest):
             historical_baseline=historical_baseline,
             ev_fleet_size=0  # Could be enhanced to detect EVs from meters
         )
-        print(f"[OK] Generated {len(recommendations)} recommendations")
-
-        # Save recommendations to database
-        saved_count = 0
-        for rec in recommendations:
-            try:
-                rec_id = save_recommendation(
-                    site_id=request.site_id,
-                    rec_type=rec['type'],
-                    headline=rec['headline'],
-                    description=rec['description'],
-                    cost_savings=rec['cost_savings'],
-                    co2_reduction=rec['co2_reduction'],
-                    confidence=rec['confidence'],
-                    action_type=rec['action_type'],
-                    recommended_time_start=rec['recommended_time_start'],
-                    recommended_time_end=rec['recommended_time_end'],
-                    supporting_data=rec['supporting_data']
-                )
-                if rec_id:
-                    saved_count += 1
-            except Exception as e:
-                print(f"Error saving recommendation: {e}")
+        logger.info("Generated %d recommendations", len(recommendations))
+
+        # Save forecasts and recommendations to database (one connection, one commit)
+        forecasts_saved, weather_forecasts_saved, saved_count = await asyncio.to_thread(
+            _save_results,
+            request.site_id,
+            consumption_forecast,
+            len(measurements['value']),
+            request.training_days,
+            future_weather_data,
+            site_info,
+            'openweathermap' if weather_service.api_key and weather_service.api_key != 'your_api_key_here' else 'mock',
+            recommendations
+        )
 
         return RecommendationResponse(
             site_id=request.site_id,
-            generated_at=datetime.now().isoformat(),
+            generated_at=datetime.now(),
             recommendations=recommendations,
             saved_count=saved_count,
             forecasts_saved=forecasts_saved,
@@ -302,16 +321,14 @@ async def generate_recommendations(request: RecommendationRequest):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[ERROR] ERROR in generate_recommendations: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in generate_recommendations: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/weather-api-usage")
 async def get_weather_api_usage():
     """Get current weather API usage statistics"""
     try:
-        weather_service = WeatherService()
+        weather_service = get_weather_service()
         stats = weather_service.get_api_usage_stats()
         return {
             "success": True,
@@ -8,11 +8,37 @@ API Documentation: https://www.electricitymaps.com/free-tier-api
 Signup: https://www.electricitymaps.com/free-tier-api
 """
 
-import requests
+import logging
 import os
+import numpy as np
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 
+from app.cache import ttl_cached
+from app.services.http import create_async_client
+
+logger = logging.getLogger(__name__)
+
+# The free tier only serves the latest hourly value (and allows 50 requests/hour)
+CARBON_CACHE_TTL_SECONDS = int(os.getenv("CARBON_CACHE_TTL_SECONDS", "3600"))
+
+# Noise source for the fallback series
+_rng = np.random.default_rng()
+
+
+def _is_live_carbon(records: List[Dict]) -> bool:
+    """False for the synthetic fallback series, which mustn't be cached for the full TTL"""
+    return not (records and records[0].get('data_source') == 'fallback')
+
+
+def _hours_of_day(start: datetime, hours: int) -> np.ndarray:
+    """Hour of day for each of `hours` consecutive hours starting at `start`"""
+    return (start.hour + np.arange(hours)) % 24
+
+def _by_ontario_period(hours: np.ndarray, values: List[float], late_evening: float) -> np.ndarray:
+    """Pick a value per hour for night (0-6), morning ramp (6-9), day (9-17) and evening peak (17-22)"""
+    return np.select([hours < 6, hours < 9, hours < 17, hours < 22], values, default=late_evening)
+
 
 class CarbonIntensityClient:
     """Client for Electricity Maps / CO2 Signal API"""
@@ -20,8 +46,14 @@ class CarbonIntensityClient:
     def __init__(self, api_key: Optional[str] = None):
         self.api_key = api_key or os.getenv('ELECTRICITYMAPS_API_KEY') or os.getenv('CO2SIGNAL_API_KEY')
         self.base_url = "https://api.electricitymap.org/v3"
+        self._client = create_async_client(timeout=10)
+
+    async def aclose(self):
+        """Close pooled connections"""
+        await self._client.aclose()
 
-    def get_carbon_intensity(
+    @ttl_cached(ttl=CARBON_CACHE_TTL_SECONDS, cache_if=_is_live_carbon)
+    async def get_carbon_intensity(
         self,
         zone: str = "CA-ON",  # Ontario, Canada
         hours_forecast: int = 24
@@ -37,7 +69,7 @@ class CarbonIntensityClient:
             List of carbon intensity records with timestamp and intensity
         """
         if not self.api_key:
-            print("[WARNING] No Electricity Maps API key found, using fallback data")
+            logger.warning("No Electricity Maps API key found, using fallback data")
             return self._get_fallback_ontario_carbon(hours_forecast)
 
         try:
@@ -49,14 +81,14 @@ class CarbonIntensityClient:
             url = f"{self.base_url}/carbon-intensity/latest"
             params = {"zone": zone}
 
-            response = requests.get(url, headers=headers, params=params, timeout=10)
+            response = await self._client.get(url, headers=headers, params=params)
 
             if response.status_code == 401:
-                print("[WARNING] Invalid Electricity Maps API key, using fallback data")
+                logger.warning("Invalid Electricity Maps API key, using fallback data")
                 return self._get_fallback_ontario_carbon(hours_forecast)
 
             if response.status_code == 429:
-                print("[WARNING] Rate limit exceeded (50 requests/hour), using fallback data")
+                logger.warning("Rate limit exceeded (50 requests/hour), using fallback data")
                 return self._get_fallback_ontario_carbon(hours_forecast)
 
             response.raise_for_status()
@@ -65,9 +97,9 @@ class CarbonIntensityClient:
 
             # Extract current carbon intensity
             current_intensity = data.get('carbonIntensity', 0)
-            current_time = datetime.fromisoformat(data.get('datetime', datetime.now().isoformat()).replace('Z', '+00:00'))
+            current_time = datetime.fromisoformat(data['datetime']) if data.get('datetime') else datetime.now()
 
-            print(f"[OK] Fetched Ontario carbon intensity: {current_intensity} gCO2/kWh")
+            logger.info("Fetched %s carbon intensity: %s gCO2/kWh", zone, current_intensity)
 
             # Since free tier doesn't include forecast, we'll create a forecast
             # based on current value + typical Ontario patterns
@@ -76,8 +108,7 @@ class CarbonIntensityClient:
             return forecast
 
         except Exception as e:
-            print(f"[WARNING] Electricity Maps API error: {e}")
-            print(f"Using fallback Ontario carbon intensity data")
+            logger.warning("Electricity Maps API error: %s - using fallback Ontario carbon intensity data", e)
             return self._get_fallback_ontario_carbon(hours_forecast)
 
     def _create_forecast_from_current(
@@ -91,41 +122,23 @@ class CarbonIntensityClient:
 
         Ontario grid is ~90% clean (nuclear + hydro), with natural gas peaking
         """
-        forecast = []
-
-        for i in range(hours):
-            timestamp = current_time + timedelta(hours=i)
-            hour = timestamp.hour
-
-            # Apply typical Ontario diurnal pattern (multiplier on current base)
-            # Ontario's carbon intensity varies based on natural gas usage
-            if 0 <= hour < 6:
-                # Night: Low demand, minimal gas, ~10% below average
-                multiplier = 0.90
-            elif 6 <= hour < 9:
-                # Morning ramp: Increasing gas, ~5% above average
-                multiplier = 1.05
-            elif 9 <= hour < 17:
-                # Daytime: Moderate demand, average
-                multiplier = 1.0
-            elif 17 <= hour < 22:
-                # Evening peak: Maximum gas generation, ~20% above average
-                multiplier = 1.20
-            else:
-                # Late evening: Decreasing, near average
-                multiplier = 0.95
-
-            intensity = current_intensity * multiplier
-
-            forecast.append({
-                'timestamp': timestamp.isoformat(),
-                'carbon_intensity': round(intensity, 1),
+        # Apply typical Ontario diurnal pattern (multiplier on current base)
+        # Ontario's carbon intensity varies based on natural gas usage:
+        # night ~10% below average, morning ramp ~5% above, daytime average,
+        # evening peak ~20% above (maximum gas generation), late evening near average
+        multiplier = _by_ontario_period(_hours_of_day(current_time, hours), [0.90, 1.05, 1.0, 1.20], 0.95)
+        intensity = np.round(current_intensity * multiplier, 1)
+
+        return [
+            {
+                'timestamp': (current_time + timedelta(hours=i)).isoformat(),
+                'carbon_intensity': value,
                 'region': 'Ontario',
                 'data_source': 'ElectricityMaps',
                 'is_forecast': i > 0  # First value is current, rest are forecast
-            })
-
-        return forecast
+            }
+            for i, value in enumerate(intensity.tolist())
+        ]
 
     def _get_fallback_ontario_carbon(self, hours: int = 24) -> List[Dict]:
         """
@@ -139,44 +152,26 @@ class CarbonIntensityClient:
 
         Reference: https://www.ieso.ca/en/Corporate-IESO/Media/Year-End-Data
         """
-        forecast = []
         now = datetime.now()
 
-        for i in range(hours):
-            timestamp = now + timedelta(hours=i)
-            hour = timestamp.hour
-
-            # Realistic Ontario carbon intensity pattern (gCO2/kWh)
-            if 0 <= hour < 6:
-                # Night: Minimal gas peaking, mostly nuclear/hydro
-                intensity = 30
-            elif 6 <= hour < 9:
-                # Morning ramp: Some gas peaking
-                intensity = 50
-            elif 9 <= hour < 17:
-                # Daytime: Moderate load, mix of sources
-                intensity = 40
-            elif 17 <= hour < 22:
-                # Evening peak: Maximum gas generation
-                intensity = 70
-            else:
-                # Late evening: Decreasing gas
-                intensity = 45
-
-            # Add small random variation
-            import random
-            variation = random.uniform(-5, 5)
-            intensity = max(25, intensity + variation)  # Ontario rarely below 25 gCO2/kWh
-
-            forecast.append({
-                'timestamp': timestamp.isoformat(),
-                'carbon_intensity': round(intensity, 1),
+        # Realistic Ontario carbon intensity pattern (gCO2/kWh): minimal gas peaking
+        # at night, some on the morning ramp, a mix of sources during the day and
+        # maximum gas generation at the evening peak
+        intensity = _by_ontario_period(_hours_of_day(now, hours), [30, 50, 40, 70], 45)
+
+        # Add small random variation; Ontario rarely below 25 gCO2/kWh
+        intensity = np.round(np.maximum(25, intensity + _rng.uniform(-5, 5, size=hours)), 1)
+
+        return [
+            {
+                'timestamp': (now + timedelta(hours=i)).isoformat(),
+                'carbon_intensity': value,
                 'region': 'Ontario',
                 'data_source': 'fallback',
                 'is_forecast': True
-            })
-
-        return forecast
+            }
+            for i, value in enumerate(intensity.tolist())
+        ]
 
     def get_historical_average(self, zone: str = "CA-ON") -> float:
         """
@@ -195,7 +190,8 @@ class CarbonIntensityClient:
 
 
 # Convenience function
-def get_ontario_carbon_intensity(hours: int = 24) -> List[Dict]:
+async def get_ontario_carbon_intensity(hours: int = 24) -> List[Dict]:
     """Quick helper to get Ontario carbon intensity forecast"""
-    client = CarbonIntensityClient()
-    return client.get_carbon_intensity(zone="CA-ON", hours_forecast=hours)
+    # The shared client, so repeat calls hit its cache (imported here: clients imports this module)
+    from app.services.clients import get_carbon_client
+    return await get_carbon_client().get_carbon_intensity(zone="CA-ON", hours_forecast=hours)
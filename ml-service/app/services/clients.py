@@ -0,0 +1,67 @@
+"""
+Shared external API clients
+
+One CAISO, Electricity Maps and OpenWeatherMap client per process, created at
+startup and reused by every request instead of being built per call. The
+recommendation engine is shared the same way.
+"""
+
+import threading
+
+from app.services.caiso_client import CAISOClient
+from app.services.carbon_intensity_client import CarbonIntensityClient
+from app.services.recommendation_engine import RecommendationEngine
+from app.services.weather_service import WeatherService
+
+_caiso_client = None
+_carbon_client = None
+_weather_service = None
+_recommendation_engine = None
+_clients_lock = threading.Lock()
+
+def init_clients():
+    """Create the shared clients (idempotent)"""
+    global _caiso_client, _carbon_client, _weather_service, _recommendation_engine
+    with _clients_lock:
+        if _caiso_client is None:
+            _caiso_client = CAISOClient()
+        if _carbon_client is None:
+            _carbon_client = CarbonIntensityClient()
+        if _weather_service is None:
+            _weather_service = WeatherService()
+        if _recommendation_engine is None:
+            _recommendation_engine = RecommendationEngine()
+
+async def close_clients():
+    """Close the shared clients' connection pools (called on app shutdown)"""
+    global _caiso_client, _carbon_client, _weather_service
+    with _clients_lock:
+        clients = [c for c in (_caiso_client, _carbon_client) if c is not None]
+        weather_service = _weather_service
+        _caiso_client = None
+        _carbon_client = None
+        _weather_service = None
+    for client in clients:
+        await client.aclose()
+    if weather_service is not None:
+        weather_service.close()
+
+def get_caiso_client() -> CAISOClient:
+    if _caiso_client is None:
+        init_clients()
+    return _caiso_client
+
+def get_carbon_client() -> CarbonIntensityClient:
+    if _carbon_client is None:
+        init_clients()
+    return _carbon_client
+
+def get_weather_service() -> WeatherService:
+    if _weather_service is None:
+        init_clients()
+    return _weather_service
+
+def get_recommendation_engine() -> RecommendationEngine:
+    if _recommendation_engine is None:
+        init_clients()
+    return _recommendation_engine
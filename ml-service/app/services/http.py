@@ -0,0 +1,41 @@
+"""
+Pooled HTTP clients for the external API clients
+
+Each client keeps one long-lived connection pool so repeated calls reuse
+keep-alive connections instead of paying a TCP (and TLS) handshake every time.
+"""
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+def create_async_client(timeout: float = 30) -> httpx.AsyncClient:
+    """Async client with a keep-alive pool; connection failures are retried"""
+    limits = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+    return httpx.AsyncClient(
+        timeout=timeout,
+        # requests followed redirects by default, httpx doesn't (CAISO's
+        # base URL is plain http)
+        follow_redirects=True,
+        limits=limits,
+        transport=httpx.AsyncHTTPTransport(retries=3, limits=limits)
+    )
+
+def create_session(pool_maxsize: int = 16) -> requests.Session:
+    """Session with a connection pool and retries on transient upstream errors"""
+    # 429 is deliberately not retried: callers fall back to estimated data
+    # instead of spending more of the upstream rate limit
+    retry = Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=["GET"],
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
@@ -1,6 +1,190 @@
+import functools
+import heapq
+import logging
+import re
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from operator import itemgetter
+from types import MappingProxyType
+from typing import List, Dict, Optional, Sequence, Tuple, Union
 import numpy as np
+import orjson
+
+from app.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_ts(timestamp: str) -> datetime:
+    """
+    Parse an ISO timestamp.
+
+    The same forecast timestamps are parsed by several recommendation builders
+    and rate lookups per run, so results are memoized on the raw string.
+    fromisoformat is C-implemented and accepts a 'Z' suffix on Python 3.11+.
+    """
+    return datetime.fromisoformat(timestamp)
+
+
+@functools.lru_cache(maxsize=4096)
+def _hour_floor(timestamp: str) -> datetime:
+    """Parsed timestamp truncated to the hour (the key CAISO prices are matched on)"""
+    return _parse_ts(timestamp).replace(minute=0, second=0, microsecond=0)
+
+
+def _record_hour(value: Union[str, datetime]) -> datetime:
+    """Hour bucket of a CAISO record timestamp, which may already be a datetime"""
+    if isinstance(value, str):
+        return _hour_floor(value)
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+@functools.lru_cache(maxsize=256)
+def _hours_mask(hour_ranges: tuple) -> int:
+    """
+    24-bit mask of the hours covered by ((start, end), ...) ranges: bit h is
+    set when start <= h < end, or for overnight ranges (start > end, e.g.
+    (19, 7)) when h >= start or h < end.
+    """
+    mask = 0
+    for hour in range(24):
+        for start_hour, end_hour in hour_ranges:
+            if start_hour > end_hour:  # Wraps around midnight
+                covered = hour >= start_hour or hour < end_hour
+            else:
+                covered = start_hour <= hour < end_hour
+            if covered:
+                mask |= 1 << hour
+                break
+    return mask
+
+
+def _in_hour_ranges(hour: int, hour_ranges: List) -> bool:
+    """Whether hour falls in any of the [start, end) ranges (see _hours_mask)"""
+    return bool((_hours_mask(tuple(map(tuple, hour_ranges))) >> hour) & 1)
+
+
+# What may follow 'YYYY-MM-DDTHH:MM:SS' for _calendar_fields' numpy fast path
+_ISO_SUFFIX = re.compile(r'(\.\d{1,6})?(Z|[+-]\d{2}:\d{2}(:\d{2})?)?')
+
+
+def _calendar_fields(timestamps: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    (month - 1, weekday, hour, parsed) arrays for a list of ISO timestamps.
+
+    Fields are those of each timestamp's own wall-clock time, as with
+    _parse_ts. That is just the 'YYYY-MM-DDTHH:MM:SS' prefix, so when every
+    suffix is a fraction and/or UTC offset (checked once per distinct
+    suffix) the prefixes are parsed in one numpy call; anything else goes
+    through the per-string parser.
+    """
+    n = len(timestamps)
+    if (all(isinstance(ts, str) and len(ts) >= 19 for ts in timestamps)
+            and all(_ISO_SUFFIX.fullmatch(suffix) for suffix in {ts[19:] for ts in timestamps})):
+        try:
+            seconds = np.array([ts[:19] for ts in timestamps], dtype='datetime64[s]')
+        except ValueError:
+            pass
+        else:
+            months = seconds.astype('datetime64[M]').astype(np.intp) % 12
+            # 1970-01-01 (day 0) was a Thursday, weekday() == 3
+            days = (seconds.astype('datetime64[D]').astype(np.intp) + 3) % 7
+            hours = seconds.astype('datetime64[h]').astype(np.intp) % 24
+            return months, days, hours, np.ones(n, dtype=bool)
+
+    months = np.zeros(n, dtype=np.intp)
+    days = np.zeros(n, dtype=np.intp)
+    hours = np.zeros(n, dtype=np.intp)
+    parsed = np.ones(n, dtype=bool)
+    for i, timestamp in enumerate(timestamps):
+        try:
+            dt = _parse_ts(timestamp)
+        except (TypeError, ValueError):
+            parsed[i] = False
+            continue
+        months[i] = dt.month - 1
+        days[i] = dt.weekday()
+        hours[i] = dt.hour
+    return months, days, hours, parsed
+
+
+# Rate structure defaults, shared instead of rebuilt on every lookup
+DEFAULT_SUMMER_MONTHS = frozenset({5, 6, 7, 8, 9})
+TOU_PERIODS = ('onPeak', 'midPeak', 'offPeak')  # Checked in this order
+_NO_CONFIG = MappingProxyType({})
+
+
+# CAISO $/kWh rates keyed by hour bucket (see _build_caiso_index)
+CaisoIndex = Dict[datetime, float]
+
+
+def _build_caiso_index(caiso_pricing: List[Dict]) -> CaisoIndex:
+    """
+    Index CAISO pricing records by hour so rate lookups are a dict hit instead
+    of a scan (and re-parse) of the whole list per forecast point.
+    The first record of each hour wins, as with the original linear scan.
+    """
+    index = {}
+    for price_record in caiso_pricing:
+        try:
+            hour = _record_hour(price_record['timestamp'])
+            rate = price_record.get('lmp_kwh', price_record.get('lmp', 0) / 1000)
+        except (KeyError, TypeError, ValueError):
+            continue
+        index.setdefault(hour, rate)
+    return index
+
+
+# (month - 1, weekday, hour) -> rate tables, keyed on the serialized rate
+# structure so every request for the same tariff shares one table
+RATE_LUT_CACHE = TTLCache(maxsize=64, ttl=3600)
+
+
+def _caiso_rate(timestamp: str, caiso_pricing: Union[List[Dict], CaisoIndex]) -> Optional[float]:
+    """CAISO rate ($/kWh) for the hour of timestamp, or None when not covered"""
+    try:
+        hour = _hour_floor(timestamp)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(caiso_pricing, dict):
+        caiso_pricing = _build_caiso_index(caiso_pricing)
+    return caiso_pricing.get(hour)
+
+
+@dataclass(frozen=True)
+class ConsumptionStats:
+    """
+    Arrays and statistics of one consumption forecast, computed once and
+    shared by the recommendation builders instead of each re-reading the dicts.
+    """
+    timestamps: List[str]
+    values: np.ndarray
+    peak_idx: int  # First index of the highest predicted value (-1 if empty)
+    p75: float  # 75th percentile of predicted values (nan if empty)
+
+    @classmethod
+    def from_forecast(cls, consumption_forecast: List[Dict]) -> "ConsumptionStats":
+        values = np.fromiter((f['predicted_value'] for f in consumption_forecast),
+                             dtype=np.float64, count=len(consumption_forecast))
+        return cls(
+            timestamps=[f['timestamp'] for f in consumption_forecast],
+            values=values,
+            peak_idx=int(values.argmax()) if values.size else -1,
+            p75=float(np.percentile(values, 75)) if values.size else float('nan')
+        )
+
+
+@dataclass(frozen=True)
+class RateTimeline:
+    """
+    Hour of day and electricity rate ($/kWh) at each forecast timestamp,
+    resolved once per recommendation pass (see
+    RecommendationEngine._materialize_rate_timeline) and shared by the builders.
+    """
+    hours: np.ndarray  # -1 where the timestamp can't be parsed
+    rates: np.ndarray
+
 
 class RecommendationEngine:
     """Generates actionable energy management recommendations with confidence scoring"""
@@ -19,7 +203,8 @@ class RecommendationEngine:
             risk_factors: List of potential risks or uncertainties
             savings_uncertainty: Uncertainty range (default ±15%)
         """
-        cost_savings = recommendation.get('cost_savings', 0)
+        # Every returned recommendation has cost_savings (it's the ranking key)
+        cost_savings = recommendation.setdefault('cost_savings', 0)
 
         # Map numeric confidence to label
         confidence_score = recommendation.get('confidence', 70)
@@ -44,7 +229,7 @@ class RecommendationEngine:
 
         return recommendation
 
-    def calculate_electricity_cost(self, consumption_kwh: float, timestamp: str, pricing_data: Dict, caiso_pricing: List[Dict] = None) -> float:
+    def calculate_electricity_cost(self, consumption_kwh: float, timestamp: str, pricing_data: Dict, caiso_pricing: Union[List[Dict], CaisoIndex] = None) -> float:
         """
         Calculate electricity cost for given consumption at a specific time.
         Prefers real-time CAISO pricing when available, falls back to TOU rate structure.
@@ -53,25 +238,16 @@ class RecommendationEngine:
             consumption_kwh: Amount of electricity consumed
             timestamp: ISO format timestamp
             pricing_data: Dictionary containing rate_structure from database
-            caiso_pricing: Optional list of CAISO real-time pricing records
+            caiso_pricing: Optional list of CAISO real-time pricing records,
+                or an index of them from _build_caiso_index
         """
-        # First, try to use CAISO real-time pricing if available
+        # First, try to use CAISO real-time pricing if available: one hour
+        # lookup, falling through to TOU when the hour isn't covered
         if caiso_pricing:
-            try:
-                dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                # Find matching CAISO pricing record (within 1 hour)
-                for price_record in caiso_pricing:
-                    price_dt = price_record['timestamp']
-                    if isinstance(price_dt, str):
-                        price_dt = datetime.fromisoformat(price_dt.replace('Z', '+00:00'))
-
-                    # Match timestamps within same hour
-                    if price_dt.replace(minute=0, second=0, microsecond=0) == dt.replace(minute=0, second=0, microsecond=0):
-                        # Use CAISO real-time LMP (already in $/kWh)
-                        rate = price_record.get('lmp_kwh', price_record.get('lmp', 0) / 1000)
-                        return consumption_kwh * rate
-            except Exception as e:
-                print(f"Warning: Could not use CAISO pricing, falling back to TOU: {e}")
+            # Matching CAISO pricing record (same hour), already in $/kWh
+            rate = _caiso_rate(timestamp, caiso_pricing)
+            if rate is not None:
+                return consumption_kwh * rate
 
         # Fallback to TOU rate structure
         if not pricing_data or not isinstance(pricing_data, dict):
@@ -84,8 +260,8 @@ class RecommendationEngine:
 
         # Parse timestamp
         try:
-            dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-        except:
+            dt = _parse_ts(timestamp)
+        except (TypeError, ValueError):
             return consumption_kwh * 0.12
 
         hour = dt.hour
@@ -98,14 +274,24 @@ class RecommendationEngine:
 
     def _get_rate_from_structure(self, rate_structure: Dict, hour: int, day_of_week: int, month: int) -> float:
         """
-        Extract rate from rate structure based on time.
+        Extract rate from rate structure based on time (via the cached rate table).
         Handles multiple rate structure formats.
         """
+        try:
+            lut = self._rate_lut(rate_structure)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            # Malformed structures can't be tabulated; resolve the one point
+            # directly so it fails (or falls back) exactly as before
+            return self._resolve_rate_from_structure(rate_structure, hour, day_of_week, month)
+        return float(lut[month - 1, day_of_week, hour])
+
+    def _resolve_rate_from_structure(self, rate_structure: Dict, hour: int, day_of_week: int, month: int) -> float:
+        """Walk the rate structure for one (month, weekday, hour)"""
         # Format 1: seasons → summer/winter → periods → onPeak/midPeak/offPeak
         if 'seasons' in rate_structure and isinstance(rate_structure['seasons'], dict):
             seasons = rate_structure['seasons']
             # Determine season
-            season = 'summer' if month in seasons.get('summer', {}).get('months', [5,6,7,8,9]) else 'winter'
+            season = 'summer' if month in seasons.get('summer', _NO_CONFIG).get('months', DEFAULT_SUMMER_MONTHS) else 'winter'
 
             if season in seasons and 'periods' in seasons[season]:
                 periods = seasons[season]['periods']
@@ -119,22 +305,15 @@ class RecommendationEngine:
             charges = rate_structure['energyCharges']
 
             # Determine season
-            season = 'summer' if month in tou.get('summer', {}).get('months', [5,6,7,8,9]) else 'winter'
+            season = 'summer' if month in tou.get('summer', _NO_CONFIG).get('months', DEFAULT_SUMMER_MONTHS) else 'winter'
 
             if season in tou and isinstance(charges, dict):
                 # Check which period this hour falls into
                 season_config = tou[season]
-                for period in ['onPeak', 'midPeak', 'offPeak']:
-                    if period in season_config:
-                        hour_ranges = season_config[period]
-                        for start_hour, end_hour in hour_ranges:
-                            # Handle overnight periods (e.g., [19, 7])
-                            if start_hour > end_hour:  # Wraps around midnight
-                                if hour >= start_hour or hour < end_hour:
-                                    return charges.get(period, 0.12)
-                            else:
-                                if start_hour <= hour < end_hour:
-                                    return charges.get(period, 0.12)
+                for period in TOU_PERIODS:
+                    # Overnight periods (e.g., [19, 7]) are handled by the hour mask
+                    if period in season_config and _in_hour_ranges(hour, season_config[period]):
+                        return charges.get(period, 0.12)
 
         # Legacy format: simple periods at top level
         for period_name, period_config in rate_structure.items():
@@ -166,39 +345,121 @@ class RecommendationEngine:
         if day_of_week not in valid_days:
             return False
 
-        # Check if hour matches
-        hour_ranges = period_config.get('hours', [])
-        for start_hour, end_hour in hour_ranges:
-            # Handle overnight periods
-            if start_hour > end_hour:  # Wraps around midnight
-                if hour >= start_hour or hour < end_hour:
-                    return True
-            else:
-                if start_hour <= hour < end_hour:
-                    return True
+        # Check if hour matches (overnight periods included)
+        return _in_hour_ranges(hour, period_config.get('hours', []))
+
+    def _build_rate_lut(self, rate_structure: Dict) -> np.ndarray:
+        """Resolve the rate for every (month, weekday, hour) of a rate structure"""
+        lut = np.empty((12, 7, 24), dtype=np.float64)
+        for month in range(1, 13):
+            for day_of_week in range(7):
+                for hour in range(24):
+                    lut[month - 1, day_of_week, hour] = self._resolve_rate_from_structure(
+                        rate_structure, hour, day_of_week, month
+                    )
+        return lut
+
+    def _rate_lut(self, rate_structure: Dict) -> np.ndarray:
+        """Cached _build_rate_lut"""
+        key = orjson.dumps(rate_structure, option=orjson.OPT_SORT_KEYS)
+        lut = RATE_LUT_CACHE.get(key)
+        if lut is None:
+            lut = self._build_rate_lut(rate_structure)
+            RATE_LUT_CACHE.set(key, lut)
+        return lut
+
+    def get_rates_at_times(self, timestamps: Sequence[str], pricing_data: Dict,
+                           caiso_pricing: Union[List[Dict], CaisoIndex] = None,
+                           calendar: Optional[Tuple[np.ndarray, ...]] = None) -> np.ndarray:
+        """
+        Batch version of get_rate_at_time: the rate ($/kWh) at each timestamp.
 
-        return False
+        TOU rates come from a per-tariff (month, weekday, hour) table, so the
+        rate structure is walked once per tariff rather than once per point;
+        CAISO prices, when available, override them hour by hour. calendar is
+        _calendar_fields(timestamps), if the caller already has it.
+        """
+        n = len(timestamps)
+        rate_structure = pricing_data.get('rate_structure') if isinstance(pricing_data, dict) else None
 
-    def get_rate_at_time(self, timestamp: str, pricing_data: Dict, caiso_pricing: List[Dict] = None) -> float:
+        if not pricing_data or not isinstance(pricing_data, dict):
+            rates = np.full(n, 0.12)
+        elif not rate_structure or not isinstance(rate_structure, dict):
+            rates = np.full(n, pricing_data.get('off_peak_rate', 0.12), dtype=np.float64)
+        else:
+            lut = self._rate_lut(rate_structure)
+            months, days, hours, parsed = calendar if calendar is not None else _calendar_fields(timestamps)
+            rates = np.where(parsed, lut[months, days, hours], 0.12)
+
+        if caiso_pricing:
+            if not isinstance(caiso_pricing, dict):
+                caiso_pricing = _build_caiso_index(caiso_pricing)
+
+            caiso_rates = np.fromiter(
+                (np.nan if rate is None else rate
+                 for rate in (_caiso_rate(ts, caiso_pricing) for ts in timestamps)),
+                dtype=np.float64, count=n
+            )
+            rates = np.where(np.isnan(caiso_rates), rates, caiso_rates)
+
+        return rates
+
+    def calculate_costs(self, consumption_kwh: Union[float, np.ndarray], timestamps: Sequence[str],
+                        pricing_data: Dict, caiso_pricing: Union[List[Dict], CaisoIndex] = None) -> np.ndarray:
+        """
+        Batch version of calculate_electricity_cost.
+
+        Args:
+            consumption_kwh: Consumption per timestamp, or one amount for all of them
+            timestamps: ISO format timestamps
+            pricing_data: Dictionary containing rate_structure from database
+            caiso_pricing: Optional CAISO records or index (see calculate_electricity_cost)
+        """
+        return np.asarray(consumption_kwh, dtype=np.float64) * self.get_rates_at_times(
+            timestamps, pricing_data, caiso_pricing
+        )
+
+    def _materialize_rate_timeline(self, timestamps: Sequence[str], pricing_data: Dict,
+                                   caiso_pricing: Union[List[Dict], CaisoIndex] = None) -> RateTimeline:
+        """Parse timestamps and resolve their rates in one pass (see RateTimeline)"""
+        calendar = _calendar_fields(timestamps)
+        _, _, hours, parsed = calendar
+        return RateTimeline(
+            hours=np.where(parsed, hours, -1),
+            rates=self.get_rates_at_times(timestamps, pricing_data, caiso_pricing, calendar)
+        )
+
+    def _normalize_pricing(self, pricing_data: Dict,
+                           caiso_pricing: Optional[List[Dict]]) -> Tuple[Optional[Dict], Optional[CaisoIndex]]:
+        """
+        Validate pricing inputs once per run.
+
+        Returns pricing_data (None if it isn't a dict; without rate_structure
+        if that can't be resolved, so lookups use the legacy flat rate) and the
+        CAISO records indexed by hour.
+        """
+        if not isinstance(pricing_data, dict):
+            pricing_data = None
+        elif isinstance(pricing_data.get('rate_structure'), dict) and pricing_data['rate_structure']:
+            try:
+                # Resolves every (month, weekday, hour), so later lookups can't fail
+                self._rate_lut(pricing_data['rate_structure'])
+            except (AttributeError, KeyError, TypeError, ValueError):
+                pricing_data = {k: v for k, v in pricing_data.items() if k != 'rate_structure'}
+
+        caiso_index = _build_caiso_index(caiso_pricing) if caiso_pricing else None
+        return pricing_data, caiso_index
+
+    def get_rate_at_time(self, timestamp: str, pricing_data: Dict, caiso_pricing: Union[List[Dict], CaisoIndex] = None) -> float:
         """
         Get the electricity rate at a specific time.
         Prefers real-time CAISO pricing when available, falls back to TOU rates.
         """
         # First, try to use CAISO real-time pricing if available
         if caiso_pricing:
-            try:
-                dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                # Find matching CAISO pricing record
-                for price_record in caiso_pricing:
-                    price_dt = price_record['timestamp']
-                    if isinstance(price_dt, str):
-                        price_dt = datetime.fromisoformat(price_dt.replace('Z', '+00:00'))
-
-                    # Match timestamps within same hour
-                    if price_dt.replace(minute=0, second=0, microsecond=0) == dt.replace(minute=0, second=0, microsecond=0):
-                        return price_record.get('lmp_kwh', price_record.get('lmp', 0) / 1000)
-            except:
-                pass
+            rate = _caiso_rate(timestamp, caiso_pricing)
+            if rate is not None:
+                return rate
 
         # Fallback to TOU rate structure
         if not pricing_data or not isinstance(pricing_data, dict):
@@ -209,95 +470,90 @@ class RecommendationEngine:
             return pricing_data.get('off_peak_rate', 0.12)
 
         try:
-            dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-            hour = dt.hour
-            day_of_week = dt.weekday()
-            month = dt.month
-
-            return self._get_rate_from_structure(rate_structure, hour, day_of_week, month)
-        except:
-            pass
+            dt = _parse_ts(timestamp)
+        except (TypeError, ValueError):
+            return 0.12
 
-        return 0.12
+        return self._get_rate_from_structure(rate_structure, dt.hour, dt.weekday(), dt.month)
 
     def generate_load_shift_recommendation(
         self,
         consumption_forecast: List[Dict],
         carbon_forecast: List[Dict],
         pricing_data: Dict,
-        caiso_pricing: List[Dict] = None
+        caiso_pricing: Union[List[Dict], CaisoIndex] = None,
+        stats: Optional[ConsumptionStats] = None,
+        timeline: Optional[RateTimeline] = None
     ) -> Dict:
         """Generate recommendation for load shifting to lower cost/carbon periods"""
-
-        # Find optimal time window
-        combined_scores = []
-        for i, cons in enumerate(consumption_forecast):
-            timestamp = cons['timestamp']
-
-            # Find matching carbon intensity
-            carbon_intensity = next(
-                (c['carbon_intensity'] for c in carbon_forecast if c['timestamp'] == timestamp),
-                40  # Default Ontario average (gCO2/kWh) - one of cleanest grids
-            )
-
-            # Calculate score (lower is better)
-            # Normalize both metrics to 0-1 scale
-            cons_norm = cons['predicted_value'] / max(c['predicted_value'] for c in consumption_forecast)
-            carbon_norm = carbon_intensity / max(c['carbon_intensity'] for c in carbon_forecast)
-
-            score = (cons_norm * 0.3) + (carbon_norm * 0.7)  # Weight carbon more heavily
-
-            combined_scores.append({
-                'timestamp': timestamp,
-                'score': score,
-                'carbon_intensity': carbon_intensity,
-                'predicted_consumption': cons['predicted_value']
-            })
+        if stats is None:
+            stats = ConsumptionStats.from_forecast(consumption_forecast)
+        if timeline is None:
+            timeline = self._materialize_rate_timeline(stats.timestamps, pricing_data, caiso_pricing)
+
+        # Find optimal time window. Carbon intensity is matched by timestamp
+        # through a dict (built reversed so the first record per timestamp
+        # wins), and both series are scored as aligned arrays
+        carbon_by_ts = {c['timestamp']: c['carbon_intensity'] for c in reversed(carbon_forecast)}
+        timestamps = stats.timestamps
+        consumption = stats.values
+        # Default Ontario average (gCO2/kWh) - one of cleanest grids
+        carbon = np.fromiter((carbon_by_ts.get(ts, 40) for ts in timestamps),
+                             dtype=np.float64, count=len(timestamps))
+
+        # Calculate score (lower is better)
+        # Normalize both metrics to 0-1 scale
+        cons_norm = consumption / consumption.max()
+        carbon_norm = carbon / max(carbon_by_ts.values())
+        scores = (cons_norm * 0.3) + (carbon_norm * 0.7)  # Weight carbon more heavily
 
         # Find best window (lowest score)
-        best_window = min(combined_scores, key=lambda x: x['score'])
-        avg_score = np.mean([s['score'] for s in combined_scores])
+        best_idx = int(scores.argmin())
+        best_timestamp = timestamps[best_idx]
+        best_carbon = float(carbon[best_idx])
+        avg_score = scores.mean()
+        peak_carbon = float(carbon.max())
 
         # Calculate potential savings
-        potential_reduction_pct = ((avg_score - best_window['score']) / avg_score) * 100
+        potential_reduction_pct = float((avg_score - scores[best_idx]) / avg_score) * 100
 
         # Estimate cost savings using actual rate structure
         estimated_load = 50  # kWh assumption for flexible loads
 
-        # Calculate average cost across all periods
-        avg_cost = np.mean([self.calculate_electricity_cost(estimated_load, s['timestamp'], pricing_data, caiso_pricing)
-                           for s in combined_scores])
-
-        # Calculate cost at best window
-        best_window_cost = self.calculate_electricity_cost(estimated_load, best_window['timestamp'], pricing_data, caiso_pricing)
+        # Calculate cost for every period in one batch: average across all
+        # periods, and cost at best window
+        costs = estimated_load * timeline.rates
+        avg_cost = costs.mean()
+        best_window_cost = costs[best_idx]
 
         # Savings from shifting load to best window
         cost_savings = avg_cost - best_window_cost
 
         # Calculate CO2 reduction
-        avg_carbon = np.mean([s['carbon_intensity'] for s in combined_scores])
-        co2_reduction = estimated_load * (avg_carbon - best_window['carbon_intensity']) / 1000  # kg
+        avg_carbon = carbon.mean()
+        co2_reduction = estimated_load * (avg_carbon - best_carbon) / 1000  # kg
 
-        timestamp_dt = datetime.fromisoformat(best_window['timestamp'].replace('Z', '+00:00'))
+        timestamp_dt = _parse_ts(best_timestamp)
+        best_time = timestamp_dt.strftime('%H:%M')
 
         return {
             'type': 'carbon',
-            'headline': f"Shift flexible loads to {timestamp_dt.strftime('%H:%M')} for lowest carbon",
+            'headline': f"Shift flexible loads to {best_time} for lowest carbon",
             'description': (
-                f"Grid carbon intensity will be lowest at {timestamp_dt.strftime('%H:%M')} "
-                f"({best_window['carbon_intensity']:.0f} g/kWh) vs peak of {max(s['carbon_intensity'] for s in combined_scores):.0f} g/kWh. "
+                f"Grid carbon intensity will be lowest at {best_time} "
+                f"({best_carbon:.0f} g/kWh) vs peak of {peak_carbon:.0f} g/kWh. "
                 f"Shift HVAC pre-cooling, EV charging, or other flexible loads to this window to reduce emissions by {potential_reduction_pct:.0f}%."
             ),
             'cost_savings': float(round(cost_savings, 2)),
             'co2_reduction': float(round(co2_reduction, 2)),
             'confidence': int(min(95, 70 + int(potential_reduction_pct))),
             'action_type': 'load_shift',
-            'recommended_time_start': best_window['timestamp'],
+            'recommended_time_start': best_timestamp,
             'recommended_time_end': (timestamp_dt + timedelta(hours=2)).isoformat(),
             'supporting_data': {
-                'optimal_carbon_intensity': best_window['carbon_intensity'],
+                'optimal_carbon_intensity': best_carbon,
                 'reduction_percent': round(potential_reduction_pct, 1),
-                'peak_carbon': max(s['carbon_intensity'] for s in combined_scores)
+                'peak_carbon': peak_carbon
             }
         }
 
@@ -305,42 +561,47 @@ class RecommendationEngine:
         self,
         consumption_forecast: List[Dict],
         pricing_data: Dict,
-        caiso_pricing: List[Dict] = None
+        caiso_pricing: Union[List[Dict], CaisoIndex] = None,
+        stats: Optional[ConsumptionStats] = None,
+        timeline: Optional[RateTimeline] = None
     ) -> Dict:
         """Generate recommendation for avoiding peak consumption periods"""
+        if stats is None:
+            stats = ConsumptionStats.from_forecast(consumption_forecast)
 
         # Identify peak consumption periods
-        values = [f['predicted_value'] for f in consumption_forecast]
-        peak_threshold = np.percentile(values, 75)
-
-        peak_periods = [f for f in consumption_forecast if f['predicted_value'] >= peak_threshold]
+        timestamps = stats.timestamps
+        values = stats.values
+        peak_mask = values >= stats.p75
+        peak_timestamps = [ts for ts, is_peak in zip(timestamps, peak_mask.tolist()) if is_peak]
 
-        if not peak_periods:
+        if not peak_timestamps:
             return None
 
         # Calculate potential savings using actual rate structure
-        avg_peak_load = np.mean([p['predicted_value'] for p in peak_periods])
+        avg_peak_load = float(values[peak_mask].mean())
         reducible_load = avg_peak_load * 0.20  # Assume 20% is reducible
 
+        # One rate lookup serves both the peak costs and the minimum rate
+        if timeline is None:
+            timeline = self._materialize_rate_timeline(timestamps, pricing_data, caiso_pricing)
+        all_rates = timeline.rates
+
         # Calculate actual cost at peak periods
-        peak_period_costs = [self.calculate_electricity_cost(reducible_load, p['timestamp'], pricing_data, caiso_pricing)
-                            for p in peak_periods]
-        total_peak_cost = sum(peak_period_costs)
+        total_peak_cost = float((reducible_load * all_rates[peak_mask]).sum())
 
         # Find the lowest rate period (likely off-peak)
-        all_rates = [self.get_rate_at_time(f['timestamp'], pricing_data, caiso_pricing) for f in consumption_forecast]
-        min_rate = min(all_rates) if all_rates else 0.08
+        min_rate = float(all_rates.min())
 
         # Savings from reducing during peak vs shifting to off-peak
-        alternative_cost = reducible_load * min_rate * len(peak_periods)
+        alternative_cost = reducible_load * min_rate * len(peak_timestamps)
         cost_savings = total_peak_cost - alternative_cost
 
-        first_peak = peak_periods[0]
-        timestamp_dt = datetime.fromisoformat(first_peak['timestamp'].replace('Z', '+00:00'))
+        timestamp_dt = _parse_ts(peak_timestamps[0])
 
         return {
             'type': 'cost',
-            'headline': f"Reduce consumption during peak hours ({timestamp_dt.strftime('%H:%M')}-{(timestamp_dt + timedelta(hours=len(peak_periods))).strftime('%H:%M')})",
+            'headline': f"Reduce consumption during peak hours ({timestamp_dt.strftime('%H:%M')}-{(timestamp_dt + timedelta(hours=len(peak_timestamps))).strftime('%H:%M')})",
             'description': (
                 f"Peak demand forecasted at {avg_peak_load:.1f} kWh during high-rate periods. "
                 f"Reduce lighting, adjust HVAC setpoints, or defer non-critical loads to save "
@@ -350,11 +611,11 @@ class RecommendationEngine:
             'co2_reduction': float(round(reducible_load * 0.04, 2)),  # CO2 estimate using Ontario 40 gCO2/kWh average
             'confidence': 85,
             'action_type': 'demand_response',
-            'recommended_time_start': first_peak['timestamp'],
-            'recommended_time_end': peak_periods[-1]['timestamp'],
+            'recommended_time_start': peak_timestamps[0],
+            'recommended_time_end': peak_timestamps[-1],
             'supporting_data': {
                 'peak_load': round(avg_peak_load, 1),
-                'peak_periods': len(peak_periods),
+                'peak_periods': len(peak_timestamps),
                 'reducible_load': round(reducible_load, 1)
             }
         }
@@ -362,7 +623,8 @@ class RecommendationEngine:
     def generate_demand_charge_avoidance(
         self,
         consumption_forecast: List[Dict],
-        pricing_data: Dict
+        pricing_data: Dict,
+        stats: Optional[ConsumptionStats] = None
     ) -> Dict:
         """Generate recommendation for avoiding demand charges by reducing peak demand"""
 
@@ -377,7 +639,11 @@ class RecommendationEngine:
             return None
 
         # Find the absolute peak consumption
-        peak_consumption = max(consumption_forecast, key=lambda x: x['predicted_value'])
+        if stats is None:
+            stats = ConsumptionStats.from_forecast(consumption_forecast)
+        if stats.peak_idx < 0:
+            return None
+        peak_consumption = consumption_forecast[stats.peak_idx]
         peak_kw = peak_consumption['predicted_value']
 
         # If below threshold, no recommendation needed
@@ -394,7 +660,7 @@ class RecommendationEngine:
         # Demand charges are typically monthly based on the highest 15-min peak
         monthly_savings = target_reduction_kw * demand_charge
 
-        timestamp_dt = datetime.fromisoformat(peak_consumption['timestamp'].replace('Z', '+00:00'))
+        timestamp_dt = _parse_ts(peak_consumption['timestamp'])
 
         return {
             'type': 'cost',
@@ -425,7 +691,8 @@ class RecommendationEngine:
         weather_forecast: List[Dict],
         consumption_forecast: List[Dict],
         pricing_data: Dict,
-        caiso_pricing: List[Dict] = None
+        caiso_pricing: Union[List[Dict], CaisoIndex] = None,
+        stats: Optional[ConsumptionStats] = None
     ) -> Optional[Dict]:
         """
         Generate weather-based alerts for extreme conditions that will impact energy costs.
@@ -435,6 +702,7 @@ class RecommendationEngine:
             consumption_forecast: Energy consumption forecast
             pricing_data: Electricity pricing structure
             caiso_pricing: Optional real-time pricing
+            stats: Optional precomputed ConsumptionStats of consumption_forecast
         """
         if not weather_forecast or len(weather_forecast) == 0:
             return None
@@ -444,7 +712,8 @@ class RecommendationEngine:
 
         if len(hot_periods) >= 3:
             # Calculate impact
-            avg_temp = np.mean([w['temperature'] for w in hot_periods])
+            hot_temps = [w['temperature'] for w in hot_periods]
+            avg_temp = sum(hot_temps) / len(hot_temps)
             duration_hours = len(hot_periods)
 
             # Estimate increased cooling load (1% increase per degree above 25°C)
@@ -453,7 +722,12 @@ class RecommendationEngine:
             consumption_increase_pct = temp_increase * 1.0  # 1% per degree
 
             # Estimate baseline consumption during this period
-            baseline_consumption = np.mean([c['predicted_value'] for c in consumption_forecast[:duration_hours]])
+            if stats is None:
+                stats = ConsumptionStats.from_forecast(consumption_forecast)
+            baseline_window = stats.values[:duration_hours]
+            if not baseline_window.size:
+                return None
+            baseline_consumption = float(baseline_window.mean())
             increased_consumption = baseline_consumption * (consumption_increase_pct / 100)
 
             # Calculate additional cost
@@ -468,8 +742,8 @@ class RecommendationEngine:
             # Savings from pre-cooling
             precool_savings = additional_cost * 0.30  # 30% savings from pre-cooling strategy
 
-            start_dt = datetime.fromisoformat(hot_periods[0]['timestamp'].replace('Z', '+00:00'))
-            end_dt = datetime.fromisoformat(hot_periods[-1]['timestamp'].replace('Z', '+00:00'))
+            start_dt = _parse_ts(hot_periods[0]['timestamp'])
+            end_dt = _parse_ts(hot_periods[-1]['timestamp'])
 
             recommendation = {
                 'type': 'weather_alert',
@@ -487,7 +761,7 @@ class RecommendationEngine:
                 'recommended_time_start': (start_dt - timedelta(hours=8)).isoformat(),  # Pre-cool 8 hours before
                 'recommended_time_end': end_dt.isoformat(),
                 'supporting_data': {
-                    'peak_temperature': round(max(w['temperature'] for w in hot_periods), 1),
+                    'peak_temperature': round(max(hot_temps), 1),
                     'duration_hours': duration_hours,
                     'consumption_increase_pct': round(consumption_increase_pct, 1),
                     'additional_cost_without_action': round(additional_cost, 2)
@@ -506,7 +780,8 @@ class RecommendationEngine:
     def generate_efficiency_alert(
         self,
         consumption_forecast: List[Dict],
-        historical_baseline: Optional[float] = None
+        historical_baseline: Optional[float] = None,
+        stats: Optional[ConsumptionStats] = None
     ) -> Optional[Dict]:
         """
         Generate efficiency/maintenance alerts by detecting consumption anomalies.
@@ -514,12 +789,15 @@ class RecommendationEngine:
         Args:
             consumption_forecast: Recent consumption forecast
             historical_baseline: Historical average consumption for comparison
+            stats: Optional precomputed ConsumptionStats of consumption_forecast
         """
         if not consumption_forecast or historical_baseline is None:
             return None
+        if stats is None:
+            stats = ConsumptionStats.from_forecast(consumption_forecast)
 
         # Calculate current average consumption
-        current_avg = np.mean([c['predicted_value'] for c in consumption_forecast])
+        current_avg = float(stats.values.mean())
 
         # Detect significant increase (>20% above baseline)
         increase_pct = ((current_avg - historical_baseline) / historical_baseline) * 100
@@ -569,7 +847,9 @@ class RecommendationEngine:
         consumption_forecast: List[Dict],
         weather_forecast: List[Dict],
         pricing_data: Dict,
-        caiso_pricing: List[Dict] = None
+        caiso_pricing: Union[List[Dict], CaisoIndex] = None,
+        stats: Optional[ConsumptionStats] = None,
+        timeline: Optional[RateTimeline] = None
     ) -> Optional[Dict]:
         """
         Generate HVAC pre-cooling/pre-heating recommendations based on pricing and weather.
@@ -579,32 +859,42 @@ class RecommendationEngine:
             weather_forecast: Weather forecast
             pricing_data: Electricity pricing
             caiso_pricing: Optional real-time pricing
+            stats: Optional precomputed ConsumptionStats of consumption_forecast
+            timeline: Optional precomputed RateTimeline of consumption_forecast
         """
         if not weather_forecast or len(weather_forecast) < 8:
             return None
+        if stats is None:
+            stats = ConsumptionStats.from_forecast(consumption_forecast)
 
         # Find the price spread between cheap and expensive hours
-        all_rates = []
-        for i, fc in enumerate(consumption_forecast[:24]):  # Next 24 hours
-            rate = self.get_rate_at_time(fc['timestamp'], pricing_data, caiso_pricing)
-            all_rates.append({'timestamp': fc['timestamp'], 'rate': rate})
-
-        if not all_rates:
+        timestamps = stats.timestamps[:24]  # Next 24 hours
+        if not timestamps:
             return None
 
-        # Sort by rate
-        sorted_rates = sorted(all_rates, key=lambda x: x['rate'])
-        cheapest_period = sorted_rates[0]
-        most_expensive_period = sorted_rates[-1]
+        if timeline is None:
+            timeline = self._materialize_rate_timeline(timestamps, pricing_data, caiso_pricing)
+        rates = timeline.rates[:24]
+        lowest_rate = float(rates.min())
+        highest_rate = float(rates.max())
 
-        # Only recommend if there's significant price spread (>40%)
-        price_spread_pct = ((most_expensive_period['rate'] - cheapest_period['rate']) / most_expensive_period['rate']) * 100
+        # Only recommend if there's significant price spread (>40%). Checked
+        # before anything else is built - flat tariffs usually stop here
+        price_spread_pct = ((highest_rate - lowest_rate) / highest_rate) * 100
 
         if price_spread_pct < 40:
             return None
 
+        # First cheapest and last most expensive hour, as a stable sort by
+        # rate would pick them
+        cheapest_period = {'timestamp': timestamps[int(rates.argmin())], 'rate': lowest_rate}
+        most_expensive_period = {
+            'timestamp': timestamps[len(rates) - 1 - int(rates[::-1].argmax())],
+            'rate': highest_rate
+        }
+
         # Estimate HVAC load (assume 40% of total consumption)
-        avg_consumption = np.mean([c['predicted_value'] for c in consumption_forecast[:8]])
+        avg_consumption = float(stats.values[:8].mean())
         hvac_load = avg_consumption * 0.40  # 40% assumption
 
         # Pre-cooling strategy: Use cheap hours to over-cool, then coast through expensive hours
@@ -612,35 +902,26 @@ class RecommendationEngine:
         coast_hours = 4
 
         # Cost of normal cooling during expensive period
-        normal_cost = self.calculate_electricity_cost(
-            hvac_load * coast_hours,
-            most_expensive_period['timestamp'],
-            pricing_data,
-            caiso_pricing
-        )
+        normal_cost = hvac_load * coast_hours * most_expensive_period['rate']
 
         # Cost of pre-cooling during cheap period (uses 20% more energy but at lower rate)
-        precool_cost = self.calculate_electricity_cost(
-            hvac_load * precool_hours * 1.2,
-            cheapest_period['timestamp'],
-            pricing_data,
-            caiso_pricing
-        )
+        precool_cost = hvac_load * precool_hours * 1.2 * cheapest_period['rate']
 
         savings = normal_cost - precool_cost
 
         if savings <= 1:  # Minimum $1 savings threshold
             return None
 
-        cheap_dt = datetime.fromisoformat(cheapest_period['timestamp'].replace('Z', '+00:00'))
-        expensive_dt = datetime.fromisoformat(most_expensive_period['timestamp'].replace('Z', '+00:00'))
+        cheap_dt = _parse_ts(cheapest_period['timestamp'])
+        cheap_time = cheap_dt.strftime('%I%p')
+        expensive_time = _parse_ts(most_expensive_period['timestamp']).strftime('%I%p')
 
         recommendation = {
             'type': 'hvac_optimization',
-            'headline': f"Pre-cool building at {cheap_dt.strftime('%I%p')} to save ${savings:.0f}",
+            'headline': f"Pre-cool building at {cheap_time} to save ${savings:.0f}",
             'description': (
-                f"Electricity is {price_spread_pct:.0f}% cheaper at {cheap_dt.strftime('%I%p')} "
-                f"(${cheapest_period['rate']:.3f}/kWh) vs {expensive_dt.strftime('%I%p')} "
+                f"Electricity is {price_spread_pct:.0f}% cheaper at {cheap_time} "
+                f"(${cheapest_period['rate']:.3f}/kWh) vs {expensive_time} "
                 f"(${most_expensive_period['rate']:.3f}/kWh). "
                 f"Pre-cool your building by lowering setpoint 2-3°C during cheap hours, "
                 f"then raise setpoint during expensive hours. Building thermal mass keeps it cool."
@@ -671,8 +952,9 @@ class RecommendationEngine:
         self,
         consumption_forecast: List[Dict],
         pricing_data: Dict,
-        caiso_pricing: List[Dict] = None,
-        ev_fleet_size: int = 0
+        caiso_pricing: Union[List[Dict], CaisoIndex] = None,
+        ev_fleet_size: int = 0,
+        timeline: Optional[RateTimeline] = None
     ) -> Optional[Dict]:
         """
         Generate EV charging optimization recommendations.
@@ -682,33 +964,33 @@ class RecommendationEngine:
             pricing_data: Electricity pricing
             caiso_pricing: Optional real-time pricing
             ev_fleet_size: Number of EVs (0 = estimate based on site)
+            timeline: Optional precomputed RateTimeline of consumption_forecast
         """
         # Only generate if site likely has EVs (could be enhanced with actual EV data)
         if ev_fleet_size == 0:
             # Skip for now - would need EV detection logic
             return None
 
+        timestamps = [fc['timestamp'] for fc in consumption_forecast[:24]]
+        if timeline is None:
+            timeline = self._materialize_rate_timeline(timestamps, pricing_data, caiso_pricing)
+        hours = timeline.hours[:24]
+        rates = timeline.rates[:24]
+
         # Find overnight low-rate period
-        overnight_periods = []
-        for fc in consumption_forecast[:24]:
-            dt = datetime.fromisoformat(fc['timestamp'].replace('Z', '+00:00'))
-            if 22 <= dt.hour or dt.hour <= 6:  # 10 PM - 6 AM
-                rate = self.get_rate_at_time(fc['timestamp'], pricing_data, caiso_pricing)
-                overnight_periods.append({'timestamp': fc['timestamp'], 'rate': rate, 'hour': dt.hour})
-
-        if not overnight_periods:
+        overnight_idx = np.flatnonzero((hours >= 22) | ((hours >= 0) & (hours <= 6)))  # 10 PM - 6 AM
+
+        if not overnight_idx.size:
             return None
 
-        # Find cheapest overnight hours
-        sorted_overnight = sorted(overnight_periods, key=lambda x: x['rate'])
-        cheapest_overnight = sorted_overnight[0]
+        # Find cheapest overnight hour (the first one on ties)
+        cheapest_idx = int(overnight_idx[rates[overnight_idx].argmin()])
+        cheapest_overnight = {'timestamp': timestamps[cheapest_idx], 'rate': float(rates[cheapest_idx])}
 
         # Find typical daytime rate
-        daytime_periods = [fc for fc in consumption_forecast[:24]
-                          if 6 < datetime.fromisoformat(fc['timestamp'].replace('Z', '+00:00')).hour < 22]
-        if daytime_periods:
-            avg_daytime_rate = np.mean([self.get_rate_at_time(p['timestamp'], pricing_data, caiso_pricing)
-                                       for p in daytime_periods])
+        daytime_mask = (hours > 6) & (hours < 22)
+        if daytime_mask.any():
+            avg_daytime_rate = float(rates[daytime_mask].mean())
         else:
             avg_daytime_rate = 0.20
 
@@ -721,7 +1003,7 @@ class RecommendationEngine:
         if savings < 5:  # Minimum $5 savings
             return None
 
-        charge_dt = datetime.fromisoformat(cheapest_overnight['timestamp'].replace('Z', '+00:00'))
+        charge_dt = _parse_ts(cheapest_overnight['timestamp'])
 
         recommendation = {
             'type': 'ev_charging',
@@ -779,10 +1061,19 @@ class RecommendationEngine:
 
         recommendations = []
 
+        # Validate pricing once; every builder below looks rates up per
+        # forecast point without re-checking it
+        pricing_data, caiso_pricing = self._normalize_pricing(pricing_data, caiso_pricing)
+
+        # One shared pass over the consumption forecast for every builder
+        stats = ConsumptionStats.from_forecast(consumption_forecast)
+        # Rates for the whole forecast, resolved once for every builder
+        timeline = self._materialize_rate_timeline(stats.timestamps, pricing_data, caiso_pricing)
+
         # 1. Load shifting recommendation
         try:
             load_shift = self.generate_load_shift_recommendation(
-                consumption_forecast, carbon_forecast, pricing_data, caiso_pricing
+                consumption_forecast, carbon_forecast, pricing_data, caiso_pricing, stats, timeline
             )
             if load_shift:
                 load_shift = self._add_explanation(
@@ -793,15 +1084,13 @@ class RecommendationEngine:
                     savings_uncertainty=0.15
                 )
                 recommendations.append(load_shift)
-        except Exception as e:
-            print(f"Error generating load shift recommendation: {e}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Error generating load shift recommendation")
 
         # 2. Peak avoidance recommendation
         try:
             peak_avoid = self.generate_peak_avoidance_recommendation(
-                consumption_forecast, pricing_data, caiso_pricing
+                consumption_forecast, pricing_data, caiso_pricing, stats, timeline
             )
             if peak_avoid:
                 peak_avoid = self._add_explanation(
@@ -811,15 +1100,13 @@ class RecommendationEngine:
                     savings_uncertainty=0.15
                 )
                 recommendations.append(peak_avoid)
-        except Exception as e:
-            print(f"Error generating peak avoidance recommendation: {e}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Error generating peak avoidance recommendation")
 
         # 3. Demand charge avoidance recommendation
         try:
             demand_avoid = self.generate_demand_charge_avoidance(
-                consumption_forecast, pricing_data
+                consumption_forecast, pricing_data, stats
             )
             if demand_avoid:
                 demand_avoid = self._add_explanation(
@@ -829,53 +1116,52 @@ class RecommendationEngine:
                     savings_uncertainty=0.10
                 )
                 recommendations.append(demand_avoid)
-        except Exception as e:
-            print(f"Error generating demand charge avoidance recommendation: {e}")
+        except Exception:
+            logger.exception("Error generating demand charge avoidance recommendation")
 
         # 4. Weather-based alerts (NEW)
         if weather_forecast:
             try:
                 weather_alert = self.generate_weather_alert(
-                    weather_forecast, consumption_forecast, pricing_data, caiso_pricing
+                    weather_forecast, consumption_forecast, pricing_data, caiso_pricing, stats
                 )
                 if weather_alert:
                     recommendations.append(weather_alert)
-            except Exception as e:
-                print(f"Error generating weather alert: {e}")
+            except Exception:
+                logger.exception("Error generating weather alert")
 
         # 5. Efficiency/Maintenance alerts (NEW)
         if historical_baseline is not None:
             try:
                 efficiency_alert = self.generate_efficiency_alert(
-                    consumption_forecast, historical_baseline
+                    consumption_forecast, historical_baseline, stats
                 )
                 if efficiency_alert:
                     recommendations.append(efficiency_alert)
-            except Exception as e:
-                print(f"Error generating efficiency alert: {e}")
+            except Exception:
+                logger.exception("Error generating efficiency alert")
 
         # 6. HVAC pre-cooling/pre-heating (NEW)
         if weather_forecast:
             try:
                 hvac_rec = self.generate_hvac_precool_recommendation(
-                    consumption_forecast, weather_forecast, pricing_data, caiso_pricing
+                    consumption_forecast, weather_forecast, pricing_data, caiso_pricing, stats, timeline
                 )
                 if hvac_rec:
                     recommendations.append(hvac_rec)
-            except Exception as e:
-                print(f"Error generating HVAC recommendation: {e}")
+            except Exception:
+                logger.exception("Error generating HVAC recommendation")
 
         # 7. EV charging optimization (NEW)
         if ev_fleet_size > 0:
             try:
                 ev_rec = self.generate_ev_charging_recommendation(
-                    consumption_forecast, pricing_data, caiso_pricing, ev_fleet_size
+                    consumption_forecast, pricing_data, caiso_pricing, ev_fleet_size, timeline
                 )
                 if ev_rec:
                     recommendations.append(ev_rec)
-            except Exception as e:
-                print(f"Error generating EV charging recommendation: {e}")
+            except Exception:
+                logger.exception("Error generating EV charging recommendation")
 
-        # Sort by cost savings (highest first) and limit to top 5 to avoid overwhelming users
-        recommendations.sort(key=lambda x: x.get('cost_savings', 0), reverse=True)
-        return recommendations[:5]  # Return top 5 most valuable recommendations
+        # Top 5 by cost savings (highest first, ties in generation order) to avoid overwhelming users
+        return heapq.nlargest(5, recommendations, key=itemgetter('cost_savings'))
@@ -4,26 +4,132 @@ Free tier: 1,000 calls/day, 5-day/3-hour forecast
 Includes caching to prevent exceeding API limits
 """
 
+import functools
+import logging
 import os
-import requests
+import threading
+import time
+import orjson
+from contextlib import contextmanager
 from typing import Dict, List, Optional
 from datetime import datetime, timedelta
 import math
 import json
 
+import numpy as np
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks; files are still swapped in atomically, unlocked
+    fcntl = None
+
+from app.cache import TTLCache
+from app.services.http import create_session
+
+logger = logging.getLogger(__name__)
+
+# Parsed forecasts per rounded location, as (fetched_at, forecasts) with
+# fetched_at from time.monotonic(). An entry is fresh for WEATHER_CACHE_HOURS
+# but kept for a day, so it can stand in when the API limit is reached or a
+# call fails; the least recently used locations are evicted beyond the cap.
+WEATHER_CACHE_SIZE = 512
+WEATHER_STALE_TTL_SECONDS = 24 * 3600
+
+# Optional JSON file the cache is saved to, so a restart doesn't start from
+# an empty cache. Workers sharing a file each load it on startup and merge
+# their own entries into it under a file lock (newest entry per location), at
+# most once per WEATHER_CACHE_PERSIST_SECONDS and again on shutdown.
+# The daily API call count lives next to it in WEATHER_CACHE_PATH + ".calls"
+# and is read and bumped under the same lock on every call, so all workers
+# share one WEATHER_MAX_DAILY_CALLS. Unset keeps everything in memory, and
+# then each worker process counts against the limit on its own.
+WEATHER_CACHE_PATH = os.getenv("WEATHER_CACHE_PATH")
+WEATHER_CACHE_PERSIST_SECONDS = int(os.getenv("WEATHER_CACHE_PERSIST_SECONDS", "60"))
+
+
+@contextmanager
+def _cache_file_lock():
+    """Exclusive lock held by whichever worker is reading/writing the files under WEATHER_CACHE_PATH"""
+    with open(f"{WEATHER_CACHE_PATH}.lock", "wb") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield  # Released when the file is closed
+
+
+def _read_call_count(day: str) -> int:
+    """API calls counted for day (ISO date) in the shared counter file; 0 for another day"""
+    try:
+        with open(f"{WEATHER_CACHE_PATH}.calls", "rb") as f:
+            call_date, call_count = orjson.loads(f.read())
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError, TypeError) as e:  # JSONDecodeError is a ValueError
+        logger.warning("Could not read API call count file %s.calls: %s", WEATHER_CACHE_PATH, e)
+        return 0
+    return call_count if call_date == day else 0
+
+
+def _write_call_count(day: str, call_count: int) -> None:
+    """Replace the shared counter file (call with _cache_file_lock held)"""
+    tmp_path = f"{WEATHER_CACHE_PATH}.calls.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps((day, call_count)))
+    os.replace(tmp_path, f"{WEATHER_CACHE_PATH}.calls")
+
+
+@functools.lru_cache(maxsize=8192)
+def _solar_irradiance(hour: int, day_of_year: int, cloud_cover: float) -> float:
+    """
+    Irradiance model behind WeatherService._estimate_solar_irradiance, memoized:
+    forecasts repeat the same (hour, day, cloud cover) combinations a lot
+    """
+    # Maximum irradiance at solar noon (varies by season)
+    # Peak irradiance ~1000 W/m² in summer, ~600 W/m² in winter
+    seasonal_factor = 0.8 + 0.2 * math.cos(2 * math.pi * (day_of_year - 172) / 365)
+    max_irradiance = 1000 * seasonal_factor
+
+    # Time of day factor (bell curve centered at solar noon ~12pm)
+    if hour < 6 or hour > 18:
+        time_factor = 0  # No sun at night
+    else:
+        # Peak at noon
+        time_factor = math.cos(math.pi * (hour - 12) / 12) ** 2
+
+    # Cloud cover reduction (0-100% clouds)
+    cloud_factor = 1 - (cloud_cover / 100) * 0.75  # Clouds reduce by up to 75%
+
+    # Calculate irradiance
+    irradiance = max_irradiance * time_factor * cloud_factor
+
+    return max(0, round(irradiance, 2))
+
 
 class WeatherService:
     # Class-level cache shared across instances
-    _cache = {}
-    _cache_timestamps = {}
+    _cache = TTLCache(maxsize=WEATHER_CACHE_SIZE, ttl=WEATHER_STALE_TTL_SECONDS)
     _api_call_count = 0
     _api_call_date = None
+    _counter_lock = threading.Lock()
+    _persist_lock = threading.Lock()
+    _persist_loaded = False
+    _last_persist: Optional[float] = None  # time.monotonic() of the last write
+    # cache_key -> Event set once the thread fetching that location is done
+    _inflight: Dict[str, threading.Event] = {}
+    _inflight_lock = threading.Lock()
 
     def __init__(self):
         self.api_key = os.getenv("OPENWEATHER_API_KEY")
         self.base_url = os.getenv("OPENWEATHER_BASE_URL", "https://api.openweathermap.org/data/2.5")
         self.cache_duration_hours = int(os.getenv("WEATHER_CACHE_HOURS", "3"))  # Cache for 3 hours by default
         self.max_daily_calls = int(os.getenv("WEATHER_MAX_DAILY_CALLS", "900"))  # Conservative limit (900 out of 1000)
+        self._session = create_session()
+        self._load_persisted_cache()
+
+    def close(self):
+        """Save the cache and close pooled connections"""
+        self._persist_cache(force=True)
+        self._session.close()
 
     def get_weather_forecast(self, lat: float, lon: float, solar_capacity_kw: float = 100.0) -> Optional[List[Dict]]:
         """
@@ -38,24 +144,53 @@ class WeatherService:
             List of weather forecasts with solar irradiance estimates
         """
         if not self.api_key or self.api_key == "your_api_key_here":
-            print("Warning: OpenWeatherMap API key not configured. Using mock data.")
+            logger.warning("OpenWeatherMap API key not configured. Using mock data.")
             return self._generate_mock_forecast(lat, lon)
 
         # Create cache key from location (rounded to 2 decimal places for nearby locations)
         cache_key = f"{round(lat, 2)}_{round(lon, 2)}"
 
         # Check if we have valid cached data
-        if self._is_cache_valid(cache_key):
-            print(f"Using cached weather data for {cache_key}")
-            return self._cache[cache_key]
+        cached = self._cache.get(cache_key)
+        if cached is not None and self._is_cache_valid(cached):
+            logger.debug("Using cached weather data for %s", cache_key)
+            return cached[1]
+
+        # Only one thread fetches a location at a time; the others wait for
+        # it and share whatever it leaves in the cache
+        with self._inflight_lock:
+            inflight = self._inflight.get(cache_key)
+            if inflight is None:
+                self._inflight[cache_key] = threading.Event()
+
+        if inflight is not None:
+            inflight.wait(timeout=15)
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                return cached[1]
+            return self._generate_mock_forecast(lat, lon, solar_capacity_kw)
 
+        try:
+            # The previous fetch may have finished between our cache read and
+            # taking the slot; don't spend another API call on it
+            cached = self._cache.get(cache_key)
+            if cached is not None and self._is_cache_valid(cached):
+                return cached[1]
+            return self._fetch_weather_forecast(cache_key, cached, lat, lon, solar_capacity_kw)
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(cache_key).set()
+
+    def _fetch_weather_forecast(self, cache_key: str, cached: Optional[tuple], lat: float, lon: float,
+                                solar_capacity_kw: float) -> List[Dict]:
+        """Call the API for a location whose cache entry (if any) is stale, within the daily limit"""
         # Check daily API call limit
-        if not self._can_make_api_call():
-            print(f"[WARNING] API call limit reached ({self.max_daily_calls} calls/day). Using cached or mock data.")
+        if not self._try_reserve_api_slot():
+            logger.warning("API call limit reached (%d calls/day). Using cached or mock data.", self.max_daily_calls)
             # Return cached data even if expired, or mock data
-            if cache_key in self._cache:
-                print("Using expired cache to avoid exceeding API limit")
-                return self._cache[cache_key]
+            if cached is not None:
+                logger.info("Using expired cache to avoid exceeding API limit")
+                return cached[1]
             return self._generate_mock_forecast(lat, lon)
 
         try:
@@ -68,73 +203,78 @@ class WeatherService:
                 "units": "metric"  # Celsius, m/s
             }
 
-            print(f"Fetching weather data from API (call {self._api_call_count + 1}/{self.max_daily_calls})")
-            response = requests.get(url, params=params, timeout=10)
+            logger.debug("Fetching weather data from API (call %d/%d)", self._api_call_count, self.max_daily_calls)
+            try:
+                response = self._session.get(url, params=params, timeout=(3.05, 10))
+            except (RequestsConnectionError, Timeout):
+                # No response, so nothing to count against the limit
+                self._release_api_slot()
+                raise
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
 
             # Parse and cache the data
             forecasts = self._parse_weather_data(data, solar_capacity_kw)
             self._update_cache(cache_key, forecasts)
-            self._increment_api_call_count()
+            logger.info("API call successful. Daily count: %d/%d", self._api_call_count, self.max_daily_calls)
+            self._persist_cache()
 
             return forecasts
 
         except Exception as e:
-            print(f"Error fetching weather forecast: {e}")
+            logger.warning("Error fetching weather forecast: %s", e)
             # Return cached data if available, otherwise mock data
-            if cache_key in self._cache:
-                print("Using cached data due to API error")
-                return self._cache[cache_key]
+            if cached is not None:
+                logger.info("Using cached data due to API error")
+                return cached[1]
             return self._generate_mock_forecast(lat, lon, solar_capacity_kw)
 
     def _parse_weather_data(self, data: Dict, solar_capacity_kw: float = 100.0) -> List[Dict]:
         """Parse OpenWeatherMap API response"""
-        forecasts = []
-
-        for item in data.get("list", [])[:40]:  # 5 days, 3-hour intervals = 40 items
-            timestamp = datetime.fromtimestamp(item["dt"])
-
-            # Extract weather data
-            temp = item["main"]["temp"]
-            humidity = item["main"]["humidity"]
-            pressure = item["main"]["pressure"]
-            clouds = item["clouds"]["all"]
-            wind_speed = item["wind"]["speed"]
-            wind_direction = item["wind"].get("deg", 0)
-
-            # Precipitation
-            rain = item.get("rain", {}).get("3h", 0)
-            snow = item.get("snow", {}).get("3h", 0)
-            precipitation = rain + snow
-
-            # Calculate solar irradiance (simplified model)
-            solar_irradiance = self._estimate_solar_irradiance(
-                timestamp, clouds, temp
-            )
-
-            # Calculate solar generation using site-specific capacity
-            solar_generation = self._estimate_solar_generation(
-                solar_irradiance, solar_capacity_kw
-            )
-
-            forecasts.append({
+        items = data.get("list", [])[:40]  # 5 days, 3-hour intervals = 40 items
+        timestamps = [datetime.fromtimestamp(item["dt"]) for item in items]
+        n = len(items)
+
+        # Solar irradiance and generation for every interval in one batch
+        solar_irradiance = self._estimate_solar_irradiance_batch(
+            np.fromiter((ts.hour for ts in timestamps), dtype=np.float64, count=n),
+            np.fromiter((ts.timetuple().tm_yday for ts in timestamps), dtype=np.float64, count=n),
+            np.fromiter((item["clouds"]["all"] for item in items), dtype=np.float64, count=n)
+        )
+        # Same model as _estimate_solar_generation
+        solar_generation = np.round(solar_capacity_kw * (solar_irradiance / 1000) * 0.85, 2)
+
+        return [
+            {
                 "timestamp": timestamp.isoformat(),
-                "temperature": temp,
-                "humidity": humidity,
-                "pressure": pressure,
-                "cloud_cover": clouds,
-                "wind_speed": wind_speed,
-                "wind_direction": wind_direction,
-                "precipitation": precipitation,
+                "temperature": item["main"]["temp"],
+                "humidity": item["main"]["humidity"],
+                "pressure": item["main"]["pressure"],
+                "cloud_cover": item["clouds"]["all"],
+                "wind_speed": item["wind"]["speed"],
+                "wind_direction": item["wind"].get("deg", 0),
+                # Precipitation: rain + snow
+                "precipitation": item.get("rain", {}).get("3h", 0) + item.get("snow", {}).get("3h", 0),
                 "precipitation_probability": item.get("pop", 0) * 100,  # Convert to percentage
-                "solar_irradiance": solar_irradiance,
-                "solar_generation": solar_generation,
+                "solar_irradiance": irradiance,
+                "solar_generation": generation,
                 "confidence": 0.85,  # OpenWeatherMap general confidence
                 "description": item["weather"][0]["description"]
-            })
-
-        return forecasts
+            }
+            for timestamp, item, irradiance, generation in zip(
+                timestamps, items, solar_irradiance.tolist(), solar_generation.tolist()
+            )
+        ]
+
+    @staticmethod
+    def _estimate_solar_irradiance_batch(hours: np.ndarray, days_of_year: np.ndarray,
+                                         cloud_cover: np.ndarray) -> np.ndarray:
+        """Array version of _estimate_solar_irradiance (W/m², rounded to 2 places)"""
+        seasonal_factor = 0.8 + 0.2 * np.cos(2 * np.pi * (days_of_year - 172) / 365)
+        time_factor = np.where((hours < 6) | (hours > 18), 0.0,
+                               np.cos(np.pi * (hours - 12) / 12) ** 2)
+        cloud_factor = 1 - (cloud_cover / 100) * 0.75
+        return np.maximum(0, np.round(1000 * seasonal_factor * time_factor * cloud_factor, 2))
 
     def _estimate_solar_irradiance(self, timestamp: datetime, cloud_cover: float, temp: float) -> float:
         """
@@ -142,31 +282,8 @@ class WeatherService:
 
         Simplified model - in production, use actual solar radiation API
         """
-        # Hour of day (0-23)
-        hour = timestamp.hour
-
-        # Day of year for seasonal variation
-        day_of_year = timestamp.timetuple().tm_yday
-
-        # Maximum irradiance at solar noon (varies by season)
-        # Peak irradiance ~1000 W/m² in summer, ~600 W/m² in winter
-        seasonal_factor = 0.8 + 0.2 * math.cos(2 * math.pi * (day_of_year - 172) / 365)
-        max_irradiance = 1000 * seasonal_factor
-
-        # Time of day factor (bell curve centered at solar noon ~12pm)
-        if hour < 6 or hour > 18:
-            time_factor = 0  # No sun at night
-        else:
-            # Peak at noon
-            time_factor = math.cos(math.pi * (hour - 12) / 12) ** 2
-
-        # Cloud cover reduction (0-100% clouds)
-        cloud_factor = 1 - (cloud_cover / 100) * 0.75  # Clouds reduce by up to 75%
-
-        # Calculate irradiance
-        irradiance = max_irradiance * time_factor * cloud_factor
-
-        return max(0, round(irradiance, 2))
+        # Hour of day (0-23), day of year for seasonal variation
+        return _solar_irradiance(timestamp.hour, timestamp.timetuple().tm_yday, cloud_cover)
 
     def _estimate_solar_generation(self, irradiance: float, capacity_kw: float) -> float:
         """
@@ -238,42 +355,161 @@ class WeatherService:
 
         return forecasts
 
-    def _is_cache_valid(self, cache_key: str) -> bool:
-        """Check if cached data is still valid"""
-        if cache_key not in self._cache or cache_key not in self._cache_timestamps:
-            return False
-
-        cached_time = self._cache_timestamps[cache_key]
-        time_elapsed = datetime.now() - cached_time
-        return time_elapsed.total_seconds() < (self.cache_duration_hours * 3600)
+    def _is_cache_valid(self, cached: tuple) -> bool:
+        """Check if a (fetched_at, forecasts) cache entry is still fresh"""
+        return time.monotonic() - cached[0] < self.cache_duration_hours * 3600
 
     def _update_cache(self, cache_key: str, data: List[Dict]) -> None:
         """Update cache with new data"""
-        self._cache[cache_key] = data
-        self._cache_timestamps[cache_key] = datetime.now()
-
-    def _can_make_api_call(self) -> bool:
-        """Check if we can make an API call without exceeding daily limit"""
-        today = datetime.now().date()
+        self._cache.set(cache_key, (time.monotonic(), data))
+
+    @classmethod
+    def _load_persisted_cache(cls) -> None:
+        """Restore the cache and today's API call count from WEATHER_CACHE_PATH (once per process)"""
+        with cls._persist_lock:
+            if not WEATHER_CACHE_PATH or cls._persist_loaded:
+                return
+            cls._persist_loaded = True
+            today = datetime.now().date()
+            with cls._counter_lock:
+                cls._api_call_date = today
+                cls._api_call_count = _read_call_count(today.isoformat())
+            try:
+                with open(WEATHER_CACHE_PATH, "rb") as f:
+                    snapshot = orjson.loads(f.read())
+            except FileNotFoundError:
+                return
+            except (OSError, orjson.JSONDecodeError) as e:
+                logger.warning("Could not read weather cache file %s: %s", WEATHER_CACHE_PATH, e)
+                return
+
+            # Saved with wall-clock fetch times; monotonic clocks don't survive restarts
+            now, now_monotonic = time.time(), time.monotonic()
+            for cache_key, (fetched_at, forecasts) in snapshot.get("entries", {}).items():
+                age = now - fetched_at
+                if age < WEATHER_STALE_TTL_SECONDS:
+                    cls._cache.set(cache_key, (now_monotonic - age, forecasts))
+
+    def _persist_cache(self, force: bool = False) -> None:
+        """
+        Merge the cache into WEATHER_CACHE_PATH, if set.
+        Skipped if the last write was under WEATHER_CACHE_PERSIST_SECONDS ago,
+        unless force is set.
+        """
+        if not WEATHER_CACHE_PATH:
+            return
+        cls = type(self)  # The cache is shared by all instances
+        with cls._persist_lock:
+            now_monotonic = time.monotonic()
+            if (not force and cls._last_persist is not None
+                    and now_monotonic - cls._last_persist < WEATHER_CACHE_PERSIST_SECONDS):
+                return
+            cls._last_persist = now_monotonic
+
+            wall_clock_offset = time.time() - now_monotonic
+            entries = {
+                cache_key: (fetched_at + wall_clock_offset, forecasts)
+                for cache_key, (fetched_at, forecasts) in cls._cache.items()
+            }
 
-        # Reset counter if it's a new day
-        if self._api_call_date != today:
-            self._api_call_count = 0
-            self._api_call_date = today
+            try:
+                # Other workers write the same file; hold the lock from
+                # reading their entries until ours are swapped in
+                with _cache_file_lock():
+                    snapshot = self._merge_persisted(entries)
+                    # Write a temporary file and swap it in, so readers never see a partial file
+                    tmp_path = f"{WEATHER_CACHE_PATH}.{os.getpid()}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        f.write(orjson.dumps(snapshot))
+                    os.replace(tmp_path, WEATHER_CACHE_PATH)
+            except OSError as e:
+                logger.warning("Could not write weather cache file %s: %s", WEATHER_CACHE_PATH, e)
+
+    @staticmethod
+    def _merge_persisted(entries: Dict[str, tuple]) -> Dict:
+        """Combine this process's cache with what WEATHER_CACHE_PATH already holds"""
+        try:
+            with open(WEATHER_CACHE_PATH, "rb") as f:
+                saved = orjson.loads(f.read())
+        except FileNotFoundError:
+            saved = {}
+        except (OSError, orjson.JSONDecodeError) as e:
+            logger.warning("Could not read weather cache file %s: %s", WEATHER_CACHE_PATH, e)
+            saved = {}
+
+        # Newest forecast per location, dropping anything past the stale TTL
+        oldest = time.time() - WEATHER_STALE_TTL_SECONDS
+        merged = {
+            cache_key: entry
+            for cache_key, entry in saved.get("entries", {}).items()
+            if entry[0] > oldest
+        }
+        for cache_key, entry in entries.items():
+            if cache_key not in merged or entry[0] > merged[cache_key][0]:
+                merged[cache_key] = entry
 
-        return self._api_call_count < self.max_daily_calls
+        return {"entries": merged}
 
-    def _increment_api_call_count(self) -> None:
-        """Increment the API call counter"""
+    def _try_reserve_api_slot(self) -> bool:
+        """
+        Count one API call against today's limit, or return False when the
+        limit is reached. Check and increment happen under one lock (and,
+        with WEATHER_CACHE_PATH, the file lock shared with the other workers),
+        so concurrent requests can't both take the last call.
+        """
         today = datetime.now().date()
-
-        # Reset counter if it's a new day
-        if self._api_call_date != today:
-            self._api_call_count = 0
-            self._api_call_date = today
-
-        self._api_call_count += 1
-        print(f"[OK] API call successful. Daily count: {self._api_call_count}/{self.max_daily_calls}")
+        cls = type(self)  # The counter is shared by all instances
+        with cls._counter_lock:
+            # Reset counter if it's a new day
+            if cls._api_call_date != today:
+                cls._api_call_count = 0
+                cls._api_call_date = today
+
+            if WEATHER_CACHE_PATH:
+                try:
+                    with _cache_file_lock():
+                        call_count = _read_call_count(today.isoformat())
+                        if call_count < self.max_daily_calls:
+                            _write_call_count(today.isoformat(), call_count + 1)
+                            call_count += 1
+                            reserved = True
+                        else:
+                            reserved = False
+                    cls._api_call_count = call_count
+                    return reserved
+                except OSError as e:
+                    logger.warning("Could not update API call count file %s.calls: %s; counting in memory",
+                                   WEATHER_CACHE_PATH, e)
+
+            if cls._api_call_count >= self.max_daily_calls:
+                return False
+            cls._api_call_count += 1
+            return True
+
+    def _release_api_slot(self) -> None:
+        """Give back a slot taken by _try_reserve_api_slot for a call that never got a response"""
+        today = datetime.now().date()
+        cls = type(self)
+        with cls._counter_lock:
+            # A slot reserved yesterday was already cleared by the reset
+            if cls._api_call_date != today:
+                return
+
+            if WEATHER_CACHE_PATH:
+                try:
+                    with _cache_file_lock():
+                        call_count = _read_call_count(today.isoformat())
+                        if call_count > 0:
+                            call_count -= 1
+                            _write_call_count(today.isoformat(), call_count)
+                    cls._api_call_count = call_count
+                    return
+                except OSError as e:
+                    logger.warning("Could not update API call count file %s.calls: %s; counting in memory",
+                                   WEATHER_CACHE_PATH, e)
+
+            if cls._api_call_count > 0:
+                cls._api_call_count -= 1
 
     def get_api_usage_stats(self) -> Dict:
         """Get current API usage statistics"""
@@ -0,0 +1,111 @@
+"""
+Process pool for CPU-bound model fitting
+
+Prophet fits hold the GIL for seconds, which would block every other request
+on the worker. Running them in separate processes keeps the event loop (and
+/health) responsive while a fit is in progress.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# Each worker is a separate Prophet/cmdstan process with its own memory, so
+# the default stays small; os.cpu_count() would be the host's core count in a
+# container, not its CPU quota
+ML_WORKERS = int(os.getenv("ML_WORKERS", "2"))
+# Run a throwaway Prophet fit in each worker as it starts (opt-in)
+ML_WARMUP = os.getenv("ML_WARMUP", "false").lower() == "true"
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Create the process pool on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn (not fork) so workers don't inherit the parent's pooled
+            # database sockets and tear them down when they exit
+            _executor = ProcessPoolExecutor(
+                max_workers=ML_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+        return _executor
+
+def _init_worker():
+    """Per-process setup: logging, then load Prophet/Stan before the first real fit"""
+    # The server's queue logging isn't running here; write straight to stderr
+    # in the same format
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "info").upper(),
+        format="%(asctime)s %(levelname)s [%(name)s] %(message)s",
+        force=True
+    )
+    if not ML_WARMUP:
+        return
+    try:
+        from app.services.consumption_forecaster import warm_up
+        warm_up()
+    except Exception:
+        # A failed warm-up only costs the first request its cold start;
+        # it must never take the worker (and the pool) down
+        pass
+
+def _noop():
+    return None
+
+def start_workers():
+    """
+    With ML_WARMUP, start one worker now so its start-up and warm-up overlap
+    with app start rather than the first request. The rest are spawned on
+    demand (the pool uses spawn, not fork), so boot never runs a Stan fit
+    per worker at once.
+    """
+    if ML_WARMUP:
+        get_process_pool().submit(_noop)
+
+def shutdown_process_pool():
+    """Stop the worker processes (called on app shutdown)"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+def _discard_broken_pool(pool: ProcessPoolExecutor):
+    """Drop a broken pool so the next get_process_pool() starts a fresh one"""
+    global _executor
+    with _executor_lock:
+        # Another caller may already have replaced it
+        if _executor is pool:
+            _executor = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+async def run_in_process(fn, *args):
+    """
+    Run a picklable top-level function in the process pool and await its result.
+    If a worker died (e.g. OOM-killed mid-fit) the pool is broken for good, so
+    it is replaced and the call retried once.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    try:
+        return await loop.run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        logger.warning("Process pool broken (a worker died); restarting it and retrying")
+        _discard_broken_pool(pool)
+        pool = get_process_pool()
+        try:
+            return await loop.run_in_executor(pool, fn, *args)
+        except BrokenProcessPool:
+            # Don't leave the next caller a broken pool either
+            _discard_broken_pool(pool)
+            raise
@@ -52,6 +52,27 @@ try:
             for row in results[:3]:
                 print(f"  - {row['timestamp']}: {row['value']} {row['unit']}")
 
+    # Stream the full history through a server-side (named) cursor, as the ML
+    # service does, instead of fetchall() on the whole result
+    print("\nTesting streamed measurements query...")
+    with conn.cursor(name='test_measurements_stream', cursor_factory=psycopg2.extensions.cursor) as cursor:
+        cursor.itersize = 10000
+        cursor.execute("""
+            SELECT m.timestamp, m.value
+            FROM measurements m
+            JOIN meters mt ON m.entity_id = mt.id
+            WHERE mt.site_id = %s
+              AND mt.category = 'CONS'
+              AND m.entity_type = 'meter'
+            ORDER BY m.timestamp ASC;
+        """, (site_id,))
+        row_count = 0
+        last_timestamp = None
+        for timestamp, value in cursor:
+            row_count += 1
+            last_timestamp = timestamp
+        print(f"Streamed {row_count} rows (last: {last_timestamp})")
+
     conn.close()
     print("\nAll database tests passed!")
 
@@ -1,65 +1,79 @@
 """Test ML service endpoints"""
-import requests
+import asyncio
+import httpx
 import json
-from datetime import datetime, timedelta
 
 ML_SERVICE_URL = "http://localhost:8000"
 
-def test_health():
+# The checks run concurrently on one pooled client; each returns its output
+# lines so the report still prints check by check
+
+async def check_health(client: httpx.AsyncClient):
     """Test health endpoint"""
-    print("Testing ML service health...")
-    response = requests.get(f"{ML_SERVICE_URL}/health")
-    print(f"Status: {response.status_code}")
-    print(f"Response: {response.json()}")
-    print()
+    lines = ["Testing ML service health..."]
+    response = await client.get("/health")
+    lines.append(f"Status: {response.status_code}")
+    lines.append(f"Response: {response.json()}")
+    return lines
 
-def test_root():
+async def check_root(client: httpx.AsyncClient):
     """Test root endpoint"""
-    print("Testing ML service root...")
-    response = requests.get(f"{ML_SERVICE_URL}/")
-    print(f"Status: {response.status_code}")
-    print(f"Response: {response.json()}")
-    print()
+    lines = ["Testing ML service root..."]
+    response = await client.get("/")
+    lines.append(f"Status: {response.status_code}")
+    lines.append(f"Response: {response.json()}")
+    return lines
 
-def test_forecast_consumption():
+async def check_forecast_consumption(client: httpx.AsyncClient):
     """Test consumption forecasting"""
-    print("Testing consumption forecasting...")
+    lines = ["Testing consumption forecasting..."]
     payload = {
         "site_id": "1cc35b4c-da27-4be2-bdb6-87435e253d9f",
         "forecast_hours": 24,
         "training_days": 7
     }
-    response = requests.post(
-        f"{ML_SERVICE_URL}/api/forecast/consumption",
-        json=payload
-    )
-    print(f"Status: {response.status_code}")
-    print(f"Response: {response.json()}")
-    print()
+    response = await client.post("/api/forecast/consumption", json=payload)
+    lines.append(f"Status: {response.status_code}")
+    lines.append(f"Response: {response.json()}")
+    return lines
 
-def test_generate_recommendations():
+async def check_generate_recommendations(client: httpx.AsyncClient):
     """Test recommendation generation"""
-    print("Testing recommendation generation...")
+    lines = ["Testing recommendation generation..."]
     payload = {
         "site_id": "1cc35b4c-da27-4be2-bdb6-87435e253d9f",
         "forecast_hours": 24,
         "training_days": 7
     }
-    response = requests.post(
-        f"{ML_SERVICE_URL}/api/recommend/generate",
-        json=payload
-    )
-    print(f"Status: {response.status_code}")
+    response = await client.post("/api/recommend/generate", json=payload)
+    lines.append(f"Status: {response.status_code}")
     if response.status_code == 200:
         data = response.json()
-        print(f"Generated {len(data.get('recommendations', []))} recommendations")
-        print(f"Saved {data.get('saved_count', 0)} to database")
+        lines.append(f"Generated {len(data.get('recommendations', []))} recommendations")
+        lines.append(f"Saved {data.get('saved_count', 0)} to database")
         if data.get('recommendations'):
-            print("\nFirst recommendation:")
-            print(json.dumps(data['recommendations'][0], indent=2))
+            lines.append("\nFirst recommendation:")
+            lines.append(json.dumps(data['recommendations'][0], indent=2))
     else:
-        print(f"Error: {response.json()}")
-    print()
+        lines.append(f"Error: {response.json()}")
+    return lines
+
+async def main():
+    async with httpx.AsyncClient(base_url=ML_SERVICE_URL, timeout=120) as client:
+        results = await asyncio.gather(
+            check_health(client),
+            check_root(client),
+            check_forecast_consumption(client),
+            check_generate_recommendations(client),
+            return_exceptions=True
+        )
+
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Error: {result!r}")
+        else:
+            print("\n".join(result))
+        print()
 
 if __name__ == "__main__":
     print("=" * 60)
@@ -67,10 +81,7 @@ if __name__ == "__main__":
     print("=" * 60)
     print()
 
-    test_health()
-    test_root()
-    test_forecast_consumption()
-    test_generate_recommendations()
+    asyncio.run(main())
 
     print("=" * 60)
     print("Test suite completed")